@@ -14,54 +14,85 @@ Claude Code 瀏覽器自動化控制腳本
 - python claude_code_automation.py "開啟電子發票平台"
 - python claude_code_automation.py "填寫發票資料" --invoice invoice.pdf
 - python claude_code_automation.py interactive  # 進入互動模式
+- python claude_code_automation.py daemon       # 啟動常駐 Chrome，之後以 --attach 連接
 """
 
 import argparse
-import json
+import asyncio
+import importlib.util
+import signal
 import sys
-import datetime
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 # 添加專案路徑
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.ai_automation import create_ai_controller
-from src.invoice_extractor import InvoiceExtractor, InvoiceData
+# 瀏覽器與 PDF 相關模組在實際需要時才載入，以縮短啟動時間
+if TYPE_CHECKING:
+    from src.invoice_extractor import InvoiceExtractor, InvoiceData
+
+
+@lru_cache(maxsize=1)
+def _get_extractor() -> "InvoiceExtractor":
+    """取得共用的發票識別器，避免每次載入發票都重新初始化"""
+    from src.invoice_extractor import InvoiceExtractor
+    return InvoiceExtractor()
 
 
 class ClaudeCodeAutomation:
     """Claude Code 專用的瀏覽器自動化控制器"""
 
-    def __init__(self, headless: bool = False):
+    def __init__(self, headless: bool = False, backend: str = "auto",
+                 attach_port: Optional[int] = None):
         """
         初始化控制器
 
         Args:
             headless: 是否使用無頭模式（不顯示瀏覽器視窗）
+            backend: 瀏覽器後端（auto 時優先使用 nodriver 直連 CDP，否則使用 Selenium）
+            attach_port: 連接既有 Chrome 的遠端除錯埠，設定時不啟動新的瀏覽器
         """
+        from src.ai_automation import create_ai_controller
+
+        self.attach_port = attach_port
         self.controller = create_ai_controller(
             use_claude=False,  # 使用本地解析器（Claude Code 本身就是 AI）
-            headless=headless
+            headless=headless,
+            backend=backend,
+            debugger_address=f"127.0.0.1:{attach_port}" if attach_port else None
         )
-        self.invoice_data: Optional[InvoiceData] = None
+        self.invoice_data: Optional["InvoiceData"] = None
         self.session_started = False
+        self._stop = False
+
+    def request_stop(self, signum=None, frame=None):
+        """要求結束互動模式（可作為 SIGINT 處理器）"""
+        self._stop = True
+        print("\n[INFO] 收到中斷信號，按 Enter 結束")
 
     def start(self):
         """啟動瀏覽器會話"""
         if not self.session_started:
-            print("[INFO] 正在啟動 Chrome 瀏覽器...")
+            if self.attach_port:
+                print(f"[INFO] 正在連接 Chrome（埠 {self.attach_port}）...")
+            else:
+                print("[INFO] 正在啟動 Chrome 瀏覽器...")
             self.controller.start_session()
             self.session_started = True
-            print("[OK] 瀏覽器已啟動")
+            print("[OK] 瀏覽器已就緒")
 
     def stop(self):
-        """停止瀏覽器會話"""
+        """停止瀏覽器會話（連接既有 Chrome 時只中斷連線）"""
         if self.session_started:
-            print("[INFO] 正在關閉瀏覽器...")
             self.controller.end_session()
             self.session_started = False
-            print("[OK] 瀏覽器已關閉")
+            if self.attach_port:
+                print("[OK] 已中斷與瀏覽器的連線")
+            else:
+                print("[OK] 瀏覽器已關閉")
 
     def load_invoice(self, pdf_path: str) -> dict:
         """
@@ -74,7 +105,7 @@ class ClaudeCodeAutomation:
             解析後的發票資料
         """
         print(f"[INFO] 正在解析發票: {pdf_path}")
-        extractor = InvoiceExtractor()
+        extractor = _get_extractor()
         self.invoice_data = extractor.extract_from_pdf(pdf_path)
         result = self.invoice_data.to_dict()
         print(f"[OK] 發票解析完成，識別率: {result.get('confidence', 0)*100:.1f}%")
@@ -90,17 +121,19 @@ class ClaudeCodeAutomation:
         Returns:
             執行結果
         """
-        if not self.session_started:
-            self.start()
-
         print(f"[EXEC] 執行指令: {prompt}")
-        result = self.controller.process_prompt(prompt, self.invoice_data)
+        try:
+            if not self.session_started:
+                self.start()
+            result = self.controller.process_prompt(prompt, self.invoice_data)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
 
         if result.get("success"):
             print(f"[OK] {result.get('message', '執行成功')}")
             if result.get("actions"):
                 for i, action in enumerate(result["actions"], 1):
-                    print(f"   {i}. {action.get('description', action.get('action_type'))}")
+                    print(f"   {i}. {action.description or action.action_type.value}")
         else:
             print(f"[ERROR] {result.get('error', '執行失敗')}")
 
@@ -121,76 +154,261 @@ class ClaudeCodeAutomation:
             return None
 
         if not filename:
-            filename = f"screenshot_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+            from src.browser_automation import default_screenshot_filename
+            filename = default_screenshot_filename()
 
         self.controller.browser.take_screenshot(filename)
         print(f"[OK] 截圖已儲存: {filename}")
         return filename
 
+    def screenshot_bytes(self, fmt: str = "jpeg", quality: int = 70) -> Optional[bytes]:
+        """
+        擷取螢幕截圖並直接返回影像內容（供後續程式處理，不寫入檔案）
+
+        Args:
+            fmt: 影像格式（jpeg, png, webp）
+            quality: 壓縮品質 0-100（png 不適用）
+
+        Returns:
+            影像 bytes，瀏覽器尚未啟動時返回 None
+        """
+        if not self.session_started:
+            print("[ERROR] 瀏覽器尚未啟動")
+            return None
+
+        return self.controller.browser.screenshot_bytes(fmt=fmt, quality=quality)
+
     def get_page_info(self) -> dict:
         """取得當前頁面資訊"""
         if not self.session_started:
             return {"error": "瀏覽器尚未啟動"}
 
-        driver = self.controller.browser.driver
-        return {
-            "url": driver.current_url,
-            "title": driver.title,
-        }
+        return self.controller.browser.get_page_info()
+
+
+# 互動模式說明
+INTERACTIVE_BANNER = "\n".join([
+    "",
+    "=" * 60,
+    "  發票自動申報助手 - Claude Code 互動模式",
+    "=" * 60,
+    "",
+    "可用指令:",
+    "  開啟電子發票平台  - 前往財政部電子發票平台",
+    "  前往 [網址]       - 導航到指定網址",
+    "  點擊 [元素]       - 點擊頁面元素",
+    "  輸入 [文字] 到 [欄位] - 在欄位中輸入文字",
+    "  填寫發票資料      - 自動填寫發票表單",
+    "  截圖              - 擷取當前頁面截圖",
+    "  等待 [秒數] 秒    - 等待指定時間",
+    "  info              - 顯示當前頁面資訊",
+    "  load [PDF路徑]    - 載入發票 PDF",
+    "  quit/exit         - 退出",
+    "",
+    "",
+    "",
+])
+
+
+def _dispatch(automation: ClaudeCodeAutomation, prompt: str) -> tuple[bool, Optional[str]]:
+    """
+    執行單一互動指令
+
+    以回傳值表示執行結果，不以例外控制流程
+
+    Returns:
+        (是否成功, 錯誤訊息)
+    """
+    command = prompt.lower()
+
+    if command == "info":
+        info = automation.get_page_info()
+        print(f"   URL: {info.get('url', 'N/A')}")
+        print(f"   Title: {info.get('title', 'N/A')}")
+        return "error" not in info, info.get("error")
+
+    if command.startswith("load "):
+        pdf_path = prompt[5:].strip()
+        if not Path(pdf_path).exists():
+            return False, f"找不到文件: {pdf_path}"
+        try:
+            automation.load_invoice(pdf_path)
+        except Exception as e:
+            return False, str(e)
+        return True, None
+
+    result = automation.execute(prompt)
+    # execute() 已自行輸出錯誤訊息
+    return result.get("success", False), None
 
 
 def interactive_mode(automation: ClaudeCodeAutomation):
     """互動模式"""
-    print("\n" + "="*60)
-    print("  發票自動申報助手 - Claude Code 互動模式")
-    print("="*60)
-    print("\n可用指令:")
-    print("  開啟電子發票平台  - 前往財政部電子發票平台")
-    print("  前往 [網址]       - 導航到指定網址")
-    print("  點擊 [元素]       - 點擊頁面元素")
-    print("  輸入 [文字] 到 [欄位] - 在欄位中輸入文字")
-    print("  填寫發票資料      - 自動填寫發票表單")
-    print("  截圖              - 擷取當前頁面截圖")
-    print("  等待 [秒數] 秒    - 等待指定時間")
-    print("  info              - 顯示當前頁面資訊")
-    print("  load [PDF路徑]    - 載入發票 PDF")
-    print("  quit/exit         - 退出")
-    print("\n")
+    sys.stdout.write(INTERACTIVE_BANNER)
 
-    while True:
+    # Ctrl-C 只設定停止旗標，於 input() 返回後檢查
+    previous_handler = signal.signal(signal.SIGINT, automation.request_stop)
+
+    while not automation._stop:
         try:
             prompt = input(">>> ").strip()
+        except EOFError:
+            break
 
-            if not prompt:
-                continue
+        if automation._stop:
+            break
+
+        if not prompt:
+            continue
 
-            if prompt.lower() in ("quit", "exit", "q"):
-                break
+        if prompt.lower() in ("quit", "exit", "q"):
+            break
 
-            if prompt.lower() == "info":
-                info = automation.get_page_info()
-                print(f"   URL: {info.get('url', 'N/A')}")
-                print(f"   Title: {info.get('title', 'N/A')}")
-                continue
+        ok, err = _dispatch(automation, prompt)
+        if not ok and err:
+            print(f"[ERROR] {err}")
 
-            if prompt.lower().startswith("load "):
-                pdf_path = prompt[5:].strip()
-                automation.load_invoice(pdf_path)
-                continue
+    signal.signal(signal.SIGINT, previous_handler)
+    automation.stop()
+    print("[INFO] 已退出互動模式")
 
-            automation.execute(prompt)
 
-        except KeyboardInterrupt:
-            print("\n[INFO] 收到中斷信號")
+# 互動模式自動完成用的指令
+INTERACTIVE_COMMANDS = [
+    "開啟電子發票平台",
+    "前往",
+    "點擊",
+    "輸入",
+    "填寫發票資料",
+    "截圖",
+    "等待",
+    "info",
+    "load",
+    "quit",
+    "exit",
+]
+
+
+async def interactive_mode_async(automation: ClaudeCodeAutomation):
+    """
+    互動模式（prompt_toolkit 非同步版本）
+
+    指令在執行緒池中執行，輸入提示不會被瀏覽器操作阻塞；
+    提供指令歷史與自動完成。
+    """
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.completion import WordCompleter
+
+    sys.stdout.write(INTERACTIVE_BANNER)
+
+    session = PromptSession(
+        completer=WordCompleter(INTERACTIVE_COMMANDS, ignore_case=True, sentence=True)
+    )
+    loop = asyncio.get_running_loop()
+
+    while True:
+        try:
+            prompt = (await session.prompt_async(">>> ")).strip()
+        except (KeyboardInterrupt, EOFError):
             break
-        except Exception as e:
-            print(f"[ERROR] {e}")
 
-    automation.stop()
+        if not prompt:
+            continue
+
+        if prompt.lower() in ("quit", "exit", "q"):
+            break
+
+        ok, err = await loop.run_in_executor(None, _dispatch, automation, prompt)
+        if not ok and err:
+            print(f"[ERROR] {err}")
+
+    await loop.run_in_executor(None, automation.stop)
     print("[INFO] 已退出互動模式")
 
 
-def main():
+@dataclass
+class CliArgs:
+    """命令列參數"""
+    command: str = "interactive"
+    invoice: Optional[str] = None
+    headless: bool = False
+    backend: str = "auto"
+    attach: Optional[int] = None
+    port: int = 9222
+    output: Optional[str] = None
+
+
+_BACKEND_CHOICES = ("auto", "nodriver", "selenium")
+
+
+def _backend_choice(value: str) -> str:
+    """檢查瀏覽器後端名稱"""
+    if value not in _BACKEND_CHOICES:
+        raise ValueError(value)
+    return value
+
+
+# 需要值的參數 -> (CliArgs 欄位, 轉換函數)
+_VALUE_OPTIONS = {
+    "--invoice": ("invoice", str),
+    "-i": ("invoice", str),
+    "--backend": ("backend", _backend_choice),
+    "--attach": ("attach", int),
+    "--port": ("port", int),
+    "--output": ("output", str),
+    "-o": ("output", str),
+}
+
+
+def _parse_args_fast(argv: list[str]) -> Optional[CliArgs]:
+    """
+    快速解析常見的命令列參數
+
+    只處理完整拼寫的已知參數；遇到 --help、未知、不完整或無效的參數時
+    返回 None，交由 argparse 輸出說明或錯誤訊息。
+
+    Args:
+        argv: 命令列參數（不含程式名稱）
+
+    Returns:
+        CliArgs，無法快速解析時返回 None
+    """
+    args = CliArgs()
+    has_command = False
+    tokens = iter(argv)
+
+    for token in tokens:
+        if token == "--headless":
+            args.headless = True
+            continue
+
+        if not token.startswith("-"):
+            if has_command:
+                return None
+            args.command = token
+            has_command = True
+            continue
+
+        option, sep, value = token.partition("=")
+        if option not in _VALUE_OPTIONS or (sep and not option.startswith("--")):
+            return None
+        if not sep:
+            value = next(tokens, None)
+            if value is None or value.startswith("-"):
+                return None
+
+        field_name, convert = _VALUE_OPTIONS[option]
+        try:
+            value = convert(value)
+        except ValueError:
+            return None
+        setattr(args, field_name, value)
+
+    return args
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    """建立完整的 argparse 解析器（用於說明與錯誤訊息）"""
     parser = argparse.ArgumentParser(
         description="Claude Code 瀏覽器自動化控制腳本",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -200,6 +418,8 @@ def main():
   %(prog)s "填寫發票資料" --invoice invoice.pdf
   %(prog)s interactive
   %(prog)s --headless "截圖"
+  %(prog)s daemon --port 9222
+  %(prog)s --attach 9222 "截圖"
         """
     )
 
@@ -207,7 +427,7 @@ def main():
         "command",
         nargs="?",
         default="interactive",
-        help="要執行的指令，或 'interactive' 進入互動模式"
+        help="要執行的指令，'interactive' 進入互動模式，或 'daemon' 啟動常駐 Chrome"
     )
 
     parser.add_argument(
@@ -221,15 +441,52 @@ def main():
         help="使用無頭模式（不顯示瀏覽器視窗）"
     )
 
+    parser.add_argument(
+        "--backend",
+        choices=list(_BACKEND_CHOICES),
+        default="auto",
+        help="瀏覽器後端（預設 auto：已安裝 nodriver 時直連 CDP）"
+    )
+
+    parser.add_argument(
+        "--attach",
+        type=int,
+        metavar="PORT",
+        help="連接已開啟遠端除錯埠的 Chrome（不會在結束時關閉瀏覽器）"
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=9222,
+        help="daemon 模式使用的遠端除錯埠（預設 9222）"
+    )
+
     parser.add_argument(
         "--output", "-o",
         help="輸出結果到 JSON 文件"
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    args = _parse_args_fast(sys.argv[1:]) or _build_parser().parse_args()
+
+    # 啟動常駐 Chrome，之後的指令以 --attach 連接以省去每次的瀏覽器啟動時間
+    if args.command.lower() == "daemon":
+        from src.browser_automation import launch_debug_chrome
+
+        launch_debug_chrome(port=args.port, headless=args.headless)
+        print(args.port)
+        return
 
     # 建立自動化實例
-    automation = ClaudeCodeAutomation(headless=args.headless)
+    automation = ClaudeCodeAutomation(
+        headless=args.headless,
+        backend=args.backend,
+        attach_port=args.attach
+    )
 
     try:
         # 載入發票（如果有指定）
@@ -238,14 +495,21 @@ def main():
 
         # 執行指令
         if args.command.lower() == "interactive":
-            interactive_mode(automation)
+            # 已安裝 prompt_toolkit 時使用非同步互動模式
+            if importlib.util.find_spec("prompt_toolkit") is not None:
+                asyncio.run(interactive_mode_async(automation))
+            else:
+                interactive_mode(automation)
         else:
             result = automation.execute(args.command)
 
             # 輸出結果
             if args.output:
-                with open(args.output, "w", encoding="utf-8") as f:
-                    json.dump(result, f, ensure_ascii=False, indent=2)
+                from src.ai_automation import serialize_result
+                from src.json_utils import dumps
+
+                with open(args.output, "wb") as f:
+                    f.write(dumps(serialize_result(result), indent=True))
                 print(f"[OK] 結果已儲存到: {args.output}")
 
     except KeyboardInterrupt:
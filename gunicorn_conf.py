@@ -0,0 +1,18 @@
+"""
+gunicorn 設定 - Web 介面正式環境
+
+使用方式：gunicorn -c gunicorn_conf.py web_app:app
+"""
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:5000")
+
+# AI 自動化會話與瀏覽器保存在程序內（AI_SESSIONS），多個 worker 會讓同一使用者的
+# 請求分散到看不到其會話的程序，因此只使用單一 worker，以執行緒處理並發請求；
+# CPU 密集的 PDF 解析已交給 web_app 內的程序池平行執行
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# 瀏覽器自動化與 PDF 解析可能耗時較久
+timeout = 120
@@ -17,12 +17,25 @@
 作者：Invoice Assistant Team
 """
 import argparse
-import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional, TYPE_CHECKING
 
-from src import PDFParser, InvoiceExtractor, BrowserAutomation
-from src.browser_automation import EInvoiceAutomation, BrowserConfig
+# 重量級模組（pdfplumber、selenium 等）在實際需要時才載入，
+# 讓 --help 等不需要它們的指令能快速啟動
+if TYPE_CHECKING:
+    from src.invoice_extractor import InvoiceExtractor
+
+
+@lru_cache(maxsize=1)
+def _get_extractor() -> "InvoiceExtractor":
+    """取得共用的發票識別器，避免每次解析都重新初始化"""
+    from src.invoice_extractor import InvoiceExtractor
+    return InvoiceExtractor()
 
 
 def parse_invoice(pdf_path: str) -> dict:
@@ -35,47 +48,93 @@ def parse_invoice(pdf_path: str) -> dict:
     Returns:
         dict: 解析結果
     """
-    extractor = InvoiceExtractor()
+    extractor = _get_extractor()
     invoice_data = extractor.extract_from_pdf(pdf_path)
     return invoice_data.to_dict()
 
 
-def print_invoice_info(invoice_dict: dict):
-    """列印發票資訊"""
-    print("\n" + "=" * 50)
-    print("📄 發票資訊解析結果")
-    print("=" * 50)
+def _init_worker():
+    """批次處理的子程序初始化：預先建立發票識別器"""
+    _get_extractor()
 
-    print(f"\n【基本資訊】")
-    print(f"  發票號碼: {invoice_dict.get('invoice_number', '未識別')}")
-    print(f"  發票日期: {invoice_dict.get('invoice_date', '未識別')}")
 
-    print(f"\n【賣方資訊】")
-    seller = invoice_dict.get('seller', {})
-    print(f"  統一編號: {seller.get('id', '未識別')}")
-    print(f"  公司名稱: {seller.get('name', '未識別')}")
+def _parse_invoice_for_batch(pdf_path: str) -> dict:
+    """批次處理用：解析單一文件，失敗時以錯誤訊息取代例外"""
+    try:
+        result = parse_invoice(pdf_path)
+    except Exception as e:
+        return {"filename": Path(pdf_path).name, "error": str(e)}
+    result["filename"] = Path(pdf_path).name
+    return result
 
-    print(f"\n【買方資訊】")
-    buyer = invoice_dict.get('buyer', {})
-    print(f"  統一編號: {buyer.get('id', '未識別')}")
-    print(f"  公司名稱: {buyer.get('name', '未識別')}")
 
-    print(f"\n【金額資訊】")
+def parse_invoices(pdf_paths: list[str], max_workers: Optional[int] = None) -> list[dict]:
+    """
+    以多個程序平行解析多張發票 PDF
+
+    Args:
+        pdf_paths: PDF 文件路徑列表
+        max_workers: 最大程序數（預設為 CPU 核心數）
+
+    Returns:
+        list[dict]: 依輸入順序排列的解析結果，失敗的文件包含 error 欄位
+    """
+    # 先在主程序建立識別器：缺少套件時立即回報，fork 的子程序也可直接沿用
+    _get_extractor()
+
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, min(4, len(pdf_paths) // workers))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        return list(executor.map(_parse_invoice_for_batch, pdf_paths, chunksize=chunksize))
+
+
+def print_invoice_info(invoice_dict: dict):
+    """列印發票資訊（組合完整內容後一次寫出）"""
+    seller = invoice_dict.get('seller', {})
+    buyer = invoice_dict.get('buyer', {})
     amounts = invoice_dict.get('amounts', {})
-    print(f"  小計（未稅）: ${amounts.get('subtotal', 0):,.0f}")
-    print(f"  稅額: ${amounts.get('tax_amount', 0):,.0f}")
-    print(f"  總計: ${amounts.get('total', 0):,.0f}")
+
+    lines = [
+        "",
+        "=" * 50,
+        "📄 發票資訊解析結果",
+        "=" * 50,
+        "",
+        "【基本資訊】",
+        f"  發票號碼: {invoice_dict.get('invoice_number', '未識別')}",
+        f"  發票日期: {invoice_dict.get('invoice_date', '未識別')}",
+        "",
+        "【賣方資訊】",
+        f"  統一編號: {seller.get('id', '未識別')}",
+        f"  公司名稱: {seller.get('name', '未識別')}",
+        "",
+        "【買方資訊】",
+        f"  統一編號: {buyer.get('id', '未識別')}",
+        f"  公司名稱: {buyer.get('name', '未識別')}",
+        "",
+        "【金額資訊】",
+        f"  小計（未稅）: ${amounts.get('subtotal', 0):,.0f}",
+        f"  稅額: ${amounts.get('tax_amount', 0):,.0f}",
+        f"  總計: ${amounts.get('total', 0):,.0f}",
+    ]
 
     items = invoice_dict.get('items', [])
     if items:
-        print(f"\n【品項明細】")
-        for i, item in enumerate(items, 1):
-            print(f"  {i}. {item['name']}")
-            print(f"     數量: {item['quantity']} | 單價: ${item['unit_price']:,.0f} | 金額: ${item['amount']:,.0f}")
+        lines.append("")
+        lines.append("【品項明細】")
+        lines.extend(
+            f"  {i}. {item['name']}\n"
+            f"     數量: {item['quantity']} | 單價: ${item['unit_price']:,.0f} | 金額: ${item['amount']:,.0f}"
+            for i, item in enumerate(items, 1)
+        )
 
     confidence = invoice_dict.get('confidence', 0)
-    print(f"\n【識別信心度】: {confidence * 100:.1f}%")
-    print("=" * 50)
+    lines.append("")
+    lines.append(f"【識別信心度】: {confidence * 100:.1f}%")
+    lines.append("=" * 50)
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def run_automation(invoice_dict: dict, headless: bool = False):
@@ -87,6 +146,7 @@ def run_automation(invoice_dict: dict, headless: bool = False):
         headless: 是否使用無頭模式
     """
     from src.invoice_extractor import InvoiceData, InvoiceItem
+    from src.browser_automation import EInvoiceAutomation, BrowserConfig
 
     # 將字典轉換回 InvoiceData 物件
     invoice_data = InvoiceData(
@@ -111,7 +171,7 @@ def run_automation(invoice_dict: dict, headless: bool = False):
         ))
 
     # 建立瀏覽器配置
-    config = BrowserConfig(headless=headless)
+    config = BrowserConfig(headless=headless, backend="auto")
     automation = EInvoiceAutomation(config)
 
     try:
@@ -129,13 +189,12 @@ def run_automation(invoice_dict: dict, headless: bool = False):
         input("\n按 Enter 繼續自動填寫表單...")
 
         print("📝 正在填寫發票資料...")
-        success = automation.fill_invoice_form(invoice_data)
+        missing = automation.fill_invoice_form_batched(invoice_data)
 
-        if success:
-            print("✅ 表單填寫完成！")
-            print("⚠️  請檢查填寫內容，確認無誤後再手動提交")
-        else:
-            print("❌ 表單填寫過程中發生錯誤")
+        if missing:
+            print(f"⚠️  找不到以下欄位: {', '.join(missing)}")
+        print("✅ 表單填寫完成！")
+        print("⚠️  請檢查填寫內容，確認無誤後再手動提交")
 
         input("\n按 Enter 關閉瀏覽器...")
 
@@ -147,8 +206,67 @@ def run_automation(invoice_dict: dict, headless: bool = False):
         print("🔒 瀏覽器已關閉")
 
 
-def run_cli():
-    """命令列模式"""
+@dataclass
+class CliArgs:
+    """命令列參數"""
+    pdf: Optional[str] = None
+    pdf_dir: Optional[str] = None
+    auto: bool = False
+    web: bool = False
+    json: bool = False
+    headless: bool = False
+
+
+# 開關型參數 -> CliArgs 欄位
+_FLAG_OPTIONS = {
+    "--auto": "auto",
+    "--web": "web",
+    "--json": "json",
+    "--headless": "headless",
+}
+
+
+def _parse_args_fast(argv: list[str]) -> Optional[CliArgs]:
+    """
+    快速解析常見的命令列參數
+
+    只處理完整拼寫的已知參數；遇到 --help、未知或不完整的參數時
+    返回 None，交由 argparse 輸出說明或錯誤訊息。
+
+    Args:
+        argv: 命令列參數（不含程式名稱）
+
+    Returns:
+        CliArgs，無法快速解析時返回 None
+    """
+    args = CliArgs()
+    tokens = iter(argv)
+
+    for token in tokens:
+        if token in _FLAG_OPTIONS:
+            setattr(args, _FLAG_OPTIONS[token], True)
+        elif token == "--pdf":
+            value = next(tokens, None)
+            if value is None or value.startswith("-"):
+                return None
+            args.pdf = value
+        elif token.startswith("--pdf="):
+            args.pdf = token[len("--pdf="):]
+        elif token == "--pdf-dir":
+            value = next(tokens, None)
+            if value is None or value.startswith("-"):
+                return None
+            args.pdf_dir = value
+        elif token.startswith("--pdf-dir="):
+            args.pdf_dir = token[len("--pdf-dir="):]
+        else:
+            return None
+
+    return args
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    """建立完整的 argparse 解析器（用於說明與錯誤訊息）"""
     parser = argparse.ArgumentParser(
         description="發票自動申報助手",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -160,6 +278,9 @@ def run_cli():
   解析並自動填寫：
     python main.py --pdf invoice.pdf --auto
 
+  批次解析資料夾中的所有 PDF：
+    python main.py --pdf-dir invoices/ --json
+
   啟動 Web 介面：
     python main.py --web
 
@@ -173,6 +294,11 @@ def run_cli():
         type=str,
         help="發票 PDF 文件路徑"
     )
+    parser.add_argument(
+        "--pdf-dir",
+        type=str,
+        help="批次解析資料夾中的所有發票 PDF（多程序平行處理）"
+    )
     parser.add_argument(
         "--auto",
         action="store_true",
@@ -194,13 +320,55 @@ def run_cli():
         help="使用無頭瀏覽器模式"
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+def run_cli():
+    """命令列模式"""
+    args = _parse_args_fast(sys.argv[1:]) or _build_parser().parse_args()
 
     # 啟動 Web 介面
     if args.web:
         print("🌐 正在啟動 Web 介面...")
-        from web_app import app
-        app.run(host="0.0.0.0", port=5000, debug=True)
+        from web_app import run_dev_server
+        run_dev_server()
+        return
+
+    # 批次處理資料夾
+    if args.pdf_dir:
+        pdf_dir = Path(args.pdf_dir)
+
+        if not pdf_dir.is_dir():
+            print(f"❌ 找不到資料夾: {pdf_dir}")
+            sys.exit(1)
+
+        pdf_paths = sorted(
+            str(path) for path in pdf_dir.iterdir()
+            if path.suffix.lower() == ".pdf"
+        )
+        if not pdf_paths:
+            print(f"❌ 資料夾中沒有 PDF 文件: {pdf_dir}")
+            sys.exit(1)
+
+        if not args.json:
+            print(f"📄 正在解析 {len(pdf_paths)} 張發票...")
+
+        try:
+            results = parse_invoices(pdf_paths)
+        except Exception as e:
+            print(f"❌ 解析失敗: {e}")
+            sys.exit(1)
+
+        if args.json:
+            from src.json_utils import dumps
+            print(dumps(results, indent=True).decode("utf-8"))
+        else:
+            for result in results:
+                if "error" in result:
+                    print(f"\n❌ {result['filename']} 解析失敗: {result['error']}")
+                else:
+                    print(f"\n📄 {result['filename']}")
+                    print_invoice_info(result)
         return
 
     # 處理 PDF 文件
@@ -217,7 +385,8 @@ def run_cli():
             invoice_dict = parse_invoice(str(pdf_path))
 
             if args.json:
-                print(json.dumps(invoice_dict, ensure_ascii=False, indent=2))
+                from src.json_utils import dumps
+                print(dumps(invoice_dict, indent=True).decode("utf-8"))
             else:
                 print_invoice_info(invoice_dict)
 
@@ -230,7 +399,7 @@ def run_cli():
             sys.exit(1)
 
     else:
-        parser.print_help()
+        _build_parser().print_help()
 
 
 if __name__ == "__main__":
@@ -1,27 +1,37 @@
 """
 發票自動申報助手 - 核心模組
+
+子模組在首次存取時才載入，避免只需要部分功能時也得載入
+selenium、pdfplumber 等重量級套件。
 """
-from .pdf_parser import PDFParser
-from .invoice_extractor import InvoiceExtractor
-from .browser_automation import BrowserAutomation, EInvoiceAutomation
-from .ai_automation import (
-    AIBrowserController,
-    AICommandParser,
-    ClaudeAutomationAgent,
-    create_ai_controller,
-    BrowserAction,
-    ActionType,
-)
+import importlib
+
+# 公開名稱 -> 所在子模組
+_EXPORTS = {
+    "PDFParser": ".pdf_parser",
+    "InvoiceExtractor": ".invoice_extractor",
+    "BrowserAutomation": ".browser_automation",
+    "EInvoiceAutomation": ".browser_automation",
+    "AIBrowserController": ".ai_automation",
+    "AICommandParser": ".ai_automation",
+    "ClaudeAutomationAgent": ".ai_automation",
+    "create_ai_controller": ".ai_automation",
+    "BrowserAction": ".ai_automation",
+    "ActionType": ".ai_automation",
+    "serialize_result": ".ai_automation",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
 
-__all__ = [
-    "PDFParser",
-    "InvoiceExtractor",
-    "BrowserAutomation",
-    "EInvoiceAutomation",
-    "AIBrowserController",
-    "AICommandParser",
-    "ClaudeAutomationAgent",
-    "create_ai_controller",
-    "BrowserAction",
-    "ActionType",
-]
+def __dir__():
+    return sorted(list(globals()) + __all__)
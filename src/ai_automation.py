@@ -4,11 +4,14 @@ AI 瀏覽器自動化模組
 使用 AI 解析自然語言指令，控制瀏覽器執行發票申報操作
 支援多種 AI 後端：Claude API、本地指令解析、Claude Code MCP
 """
+import copy
+import hashlib
 import json
 import re
 import time
-import datetime
-from typing import Optional, Dict, Any, List, Callable
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Callable, Tuple, Iterator
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -18,8 +21,14 @@ try:
 except ImportError:
     HAS_ANTHROPIC = False
 
-from .browser_automation import EInvoiceAutomation, BrowserConfig
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+from .browser_automation import EInvoiceAutomation, BrowserConfig, By, default_screenshot_filename
 from .invoice_extractor import InvoiceData
+from . import json_utils
 
 
 class ActionType(Enum):
@@ -38,7 +47,11 @@ class ActionType(Enum):
     CUSTOM_SCRIPT = "custom_script"
 
 
-@dataclass
+# 值 -> 操作類型，解析 Claude 回應時以字典查詢取代 ActionType(value)
+_ACTION_TYPE_MAP: Dict[str, ActionType] = {member.value: member for member in ActionType}
+
+
+@dataclass(slots=True)
 class BrowserAction:
     """瀏覽器操作指令"""
     action_type: ActionType
@@ -59,7 +72,7 @@ class BrowserAction:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class AutomationSession:
     """自動化會話狀態"""
     session_id: str
@@ -72,6 +85,195 @@ class AutomationSession:
     invoice_data: Optional[Dict[str, Any]] = None
 
 
+# 指令模式開頭的字面關鍵字，例如 (?:開啟|打開) -> ["開啟", "打開"]
+_ANCHOR_RE = re.compile(r"^\(\?:([^()\\]+)\)")
+
+
+def _build_keyword_index(patterns: List[str]) -> Tuple[Dict[str, List[int]], List[int]]:
+    """
+    建立關鍵字到指令模式索引的對照
+
+    Args:
+        patterns: 正則表達式原始字串列表
+
+    Returns:
+        (關鍵字 -> 模式索引列表, 沒有字面關鍵字、每次都需比對的模式索引)
+    """
+    index: Dict[str, List[int]] = {}
+    always: List[int] = []
+    for i, pattern in enumerate(patterns):
+        anchor = _ANCHOR_RE.match(pattern)
+        if not anchor:
+            always.append(i)
+            continue
+        for keyword in anchor.group(1).split("|"):
+            index.setdefault(keyword.lower(), []).append(i)
+    return index, always
+
+
+def _is_keyword_only(pattern: str) -> bool:
+    """模式是否只是關鍵字的交替（沒有其他條件與擷取群組）"""
+    anchor = _ANCHOR_RE.match(pattern)
+    return anchor is not None and anchor.end() == len(pattern)
+
+
+def _build_automaton(index: Dict[str, List[int]]):
+    """以關鍵字對照建立 Aho-Corasick 自動機（未安裝 pyahocorasick 時返回 None）"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword, indices in index.items():
+        automaton.add_word(keyword, tuple(indices))
+    automaton.make_automaton()
+    return automaton
+
+
+# 含有這些字元的目標視為 CSS 選擇器，其餘視為 id/name/文字描述
+_CSS_SYNTAX_RE = re.compile(r"[#.\[\]>:*=~+]")
+
+# 以空白分隔的 ASCII 識別字（如 "button"、"form input"）也是合法的 CSS 標籤／後代選擇器，
+# 轉為等價的 XPath 併入聯集，不必為了可能是 id 的單字多等一次 CSS 查詢超時
+_CSS_TAG_PATH_RE = re.compile(r"[A-Za-z][\w-]*(?:\s+[A-Za-z][\w-]*)*", re.ASCII)
+
+
+def _xpath_literal(text: str) -> str:
+    """將字串轉為 XPath 字面值（同時含單雙引號時以 concat() 組合）"""
+    if "'" not in text:
+        return f"'{text}'"
+    if '"' not in text:
+        return f'"{text}"'
+    parts = text.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in parts) + ")"
+
+
+def _extract_json_array(text: str) -> Optional[str]:
+    """
+    找出文字中第一個括號平衡的 JSON 陣列
+
+    逐字掃描並追蹤字串與跳脫狀態，字串內的括號不計入深度；
+    線性時間，不會像貪婪正則一樣把多個陣列之間的文字一併取出。
+
+    Args:
+        text: Claude 回應文字
+
+    Returns:
+        陣列原始字串，找不到完整陣列時返回 None
+    """
+    start = text.find("[")
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+@lru_cache(maxsize=512)
+def _target_xpath(target: str, match_text: bool) -> str:
+    """
+    建立定位目標的 XPath 聯集（重試或重複點擊同一目標時直接取快取）
+
+    Args:
+        target: 元素 id/name、文字，或只由標籤名稱組成的 CSS 選擇器
+        match_text: 是否比對元素文字、按鈕、連結文字與 input 的 value
+
+    Returns:
+        只取第一個結果的 XPath
+    """
+    literal = _xpath_literal(target)
+    paths = [f"//*[@id = {literal}]", f"//*[@name = {literal}]"]
+    if _CSS_TAG_PATH_RE.fullmatch(target.strip()):
+        paths.insert(0, "//" + "//".join(target.split()))
+    if match_text:
+        paths += [
+            f"//button[normalize-space(.) = {literal}]",
+            f"//a[normalize-space(.) = {literal}]",
+            f"//input[@value = {literal}]",
+            f"//*[normalize-space(text()) = {literal}]",
+        ]
+    return f"({' | '.join(paths)})[1]"
+
+
+class _ActionArrayScanner:
+    """
+    串流回應的增量掃描器
+
+    每次餵入新文字後，取出頂層陣列中已完整閉合的物件原始字串。
+    掃描位置跨呼叫保留，整段回應只掃描一次。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.object_start = -1
+        self.done = False
+
+    def feed(self, text: str) -> List[str]:
+        """
+        加入新文字
+
+        Args:
+            text: 新收到的文字片段
+
+        Returns:
+            本次新完成的頂層物件字串列表
+        """
+        self.buffer += text
+        objects = []
+        buffer = self.buffer
+
+        while self.pos < len(buffer) and not self.done:
+            char = buffer[self.pos]
+            if self.depth == 0:
+                # 陣列開始前的說明文字不追蹤字串狀態
+                if char == "[":
+                    self.depth = 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "[{":
+                if self.depth == 1 and char == "{":
+                    self.object_start = self.pos
+                self.depth += 1
+            elif char in "]}":
+                self.depth -= 1
+                if self.depth == 1 and char == "}" and self.object_start >= 0:
+                    objects.append(buffer[self.object_start:self.pos + 1])
+                    self.object_start = -1
+                elif self.depth == 0:
+                    self.done = True
+            self.pos += 1
+
+        return objects
+
+
 class AICommandParser:
     """
     AI 指令解析器
@@ -87,21 +289,43 @@ class AICommandParser:
         "營業稅": "https://tax.nat.gov.tw/",
         "財政部": "https://www.mof.gov.tw/",
     }
+    _KNOWN_SITES_LOWER: List[Tuple[str, str]] = [
+        (keyword.lower(), url) for keyword, url in KNOWN_SITES.items()
+    ]
 
-    # 常用操作模式
+    # 常用操作模式（依具體程度排序，只取第一個匹配的模式）
     COMMAND_PATTERNS = {
-        r"(?:開啟|打開|前往|去|到|訪問)\s*(.+)": "navigate",
-        r"(?:登入|登錄|signin|login)": "login",
-        r"(?:輸入|填入|填寫|打)\s*(.+)\s*(?:到|在)\s*(.+)": "type",
+        r"(?:填寫發票|自動填表|填入發票資料)": "fill_form",
+        # 參數以非空白字元開頭並以惰性比對，避免 \s* 與 .+ 重疊造成大量回溯
+        r"(?:輸入|填入|填寫|打)\s*(\S.*?)\s*(?:到|在)\s*(\S.*?)\s*$": "type",
         r"(?:點擊|點選|按|click)\s*(.+)": "click",
+        r"(?:選擇|select)\s*(.+)": "select",
         r"(?:等待|wait)\s*(\d+)\s*秒?": "wait",
+        r"(?:滾動|scroll)\s*(上|下|到底)": "scroll",
+        r"(?:登入|登錄|signin|login)": "login",
         r"(?:截圖|screenshot|擷取)": "screenshot",
         r"(?:提交|送出|submit)": "submit",
-        r"(?:選擇|select)\s*(.+)": "select",
-        r"(?:滾動|scroll)\s*(上|下|到底)": "scroll",
-        r"(?:填寫發票|自動填表|填入發票資料)": "fill_form",
+        # 「去」「到」幾乎出現在任何指令中（如「登入到平台」），導航放在最後
+        r"(?:開啟|打開|前往|去|到|訪問)\s*(.+)": "navigate",
     }
 
+    # 類別載入時預先編譯，解析指令時不需再查詢 re 快取
+    _COMPILED_PATTERNS: List[Tuple[re.Pattern, str]] = [
+        (re.compile(pattern, re.IGNORECASE), action_type)
+        for pattern, action_type in COMMAND_PATTERNS.items()
+    ]
+
+    # 關鍵字預篩：只對指令中出現關鍵字的模式執行正則比對
+    _KEYWORD_INDEX, _ALWAYS_MATCH = _build_keyword_index(list(COMMAND_PATTERNS))
+    _AUTOMATON = _build_automaton(_KEYWORD_INDEX)
+    # 純關鍵字模式：預篩命中即代表匹配，不需再執行正則
+    _KEYWORD_ONLY = frozenset(
+        i for i, pattern in enumerate(COMMAND_PATTERNS) if _is_keyword_only(pattern)
+    )
+
+    # 指令中的滾動方向 -> 操作值
+    _SCROLL_DIRECTIONS = {"上": "up", "下": "down", "到底": "bottom"}
+
     def __init__(self):
         self.context: Dict[str, Any] = {}
 
@@ -118,13 +342,17 @@ class AICommandParser:
         actions = []
         command = command.strip().lower()
 
-        # 嘗試匹配已知模式
-        for pattern, action_type in self.COMMAND_PATTERNS.items():
-            match = re.search(pattern, command, re.IGNORECASE)
-            if match:
-                action = self._create_action(action_type, match, command)
-                if action:
-                    actions.append(action)
+        # 依序嘗試預篩出的候選模式，第一個成功建立操作的模式即為結果
+        for i in self._candidate_patterns(command):
+            pattern, action_type = self._COMPILED_PATTERNS[i]
+            if i in self._KEYWORD_ONLY:
+                action = self._create_action(action_type, None, command)
+            else:
+                match = pattern.search(command)
+                action = self._create_action(action_type, match, command) if match else None
+            if action:
+                actions.append(action)
+                break
 
         # 如果沒有匹配，返回一個通用操作
         if not actions:
@@ -136,9 +364,29 @@ class AICommandParser:
 
         return actions
 
-    def _create_action(self, action_type: str, match: re.Match,
+    def _candidate_patterns(self, command: str) -> List[int]:
+        """
+        以關鍵字預篩可能匹配的指令模式
+
+        Args:
+            command: 已轉為小寫的指令
+
+        Returns:
+            依原順序排列的模式索引
+        """
+        candidates = set(self._ALWAYS_MATCH)
+        if self._AUTOMATON is not None:
+            for _, indices in self._AUTOMATON.iter(command):
+                candidates.update(indices)
+        else:
+            for keyword, indices in self._KEYWORD_INDEX.items():
+                if keyword in command:
+                    candidates.update(indices)
+        return sorted(candidates)
+
+    def _create_action(self, action_type: str, match: Optional[re.Match],
                        full_command: str) -> Optional[BrowserAction]:
-        """根據匹配結果創建操作"""
+        """根據匹配結果創建操作（純關鍵字模式不傳入 match）"""
 
         if action_type == "navigate":
             target = match.group(1) if match.groups() else ""
@@ -181,6 +429,14 @@ class AICommandParser:
                 description=f"等待 {seconds} 秒"
             )
 
+        elif action_type == "scroll":
+            direction = self._SCROLL_DIRECTIONS.get(match.group(1), "down")
+            return BrowserAction(
+                action_type=ActionType.SCROLL,
+                value=direction,
+                description=f"滾動頁面 {match.group(1)}"
+            )
+
         elif action_type == "screenshot":
             return BrowserAction(
                 action_type=ActionType.SCREENSHOT,
@@ -201,12 +457,14 @@ class AICommandParser:
 
         return None
 
-    def _resolve_url(self, target: str) -> str:
-        """解析目標為 URL"""
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _resolve_url(target: str) -> str:
+        """解析目標為 URL（結果只取決於目標字串，重複指令直接取快取）"""
         target_lower = target.lower()
 
         # 檢查是否是已知網站
-        for keyword, url in self.KNOWN_SITES.items():
+        for keyword, url in AICommandParser._KNOWN_SITES_LOWER:
             if keyword in target_lower:
                 return url
 
@@ -264,6 +522,16 @@ class ClaudeAutomationAgent:
 
 請根據用戶指令生成操作步驟。"""
 
+    # 提示快取：系統提示固定不變，標記為快取前綴，後續請求只需計費快取讀取
+    _CACHE_CONTROL = {"type": "ephemeral"}
+    _MIN_CACHE_TOKENS = 1024
+
+    # 送出的對話歷史上限（訊息數，需為偶數）
+    HISTORY_MAX_MESSAGES = 20
+    _SYSTEM_BLOCKS = [
+        {"type": "text", "text": SYSTEM_PROMPT, "cache_control": _CACHE_CONTROL},
+    ]
+
     def __init__(self, api_key: Optional[str] = None):
         """
         初始化 Claude 代理
@@ -275,7 +543,11 @@ class ClaudeAutomationAgent:
             raise ImportError("請安裝 anthropic: pip install anthropic")
 
         self.client = anthropic.Anthropic(api_key=api_key)
-        self.conversation_history: List[Dict[str, str]] = []
+        # 只保留最近的對話輪次，控制每次請求的 token 數；每輪開始前以完整的
+        # （用戶、助手）輪次裁剪（見 _trim_history），視窗內第一則一定是用戶訊息
+        self.conversation_history: "deque[Dict[str, str]]" = deque()
+        # 最近一輪的助手回應文字（沒有回應時為空字串），供呼叫端快取
+        self.last_reply = ""
 
     def generate_actions(self, user_prompt: str,
                         invoice_data: Optional[InvoiceData] = None) -> List[BrowserAction]:
@@ -289,56 +561,181 @@ class ClaudeAutomationAgent:
         Returns:
             操作序列
         """
-        # 構建完整提示
-        context = ""
-        if invoice_data:
-            context = f"\n\n當前發票資料:\n{json.dumps(invoice_data.to_dict(), ensure_ascii=False, indent=2)}"
+        return list(self.stream_actions(user_prompt, invoice_data))
+
+    def stream_actions(self, user_prompt: str,
+                       invoice_data: Optional[InvoiceData] = None) -> Iterator[BrowserAction]:
+        """
+        以串流方式呼叫 Claude，陣列中每個操作物件一完整就立即產出
 
-        full_prompt = user_prompt + context
+        呼叫端可在模型仍在生成時開始執行先前的操作。
 
-        # 添加到對話歷史
+        Args:
+            user_prompt: 用戶指令
+            invoice_data: 可選的發票資料
+
+        Yields:
+            瀏覽器操作
+        """
+        # 添加到對話歷史（先裁剪舊輪次，留出本輪用戶與助手訊息的空間）
+        self._trim_history()
+        self.last_reply = ""
         self.conversation_history.append({
             "role": "user",
-            "content": full_prompt
+            "content": self._build_prompt(user_prompt, invoice_data)
         })
 
-        # 呼叫 Claude API
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2048,
-            system=self.SYSTEM_PROMPT,
-            messages=self.conversation_history
-        )
+        scanner = _ActionArrayScanner()
+        yielded = 0
+        parse_error: Optional[Exception] = None
+
+        try:
+            # 呼叫 Claude API
+            with self.client.messages.stream(
+                model="claude-sonnet-4-20250514",
+                max_tokens=2048,
+                system=self._SYSTEM_BLOCKS,
+                messages=self._cached_messages()
+            ) as stream:
+                for text in stream.text_stream:
+                    if parse_error:
+                        continue
+                    for raw in scanner.feed(text):
+                        try:
+                            action = self._action_from_dict(json_utils.loads(raw))
+                        except ValueError as e:
+                            parse_error = e
+                            break
+                        yielded += 1
+                        yield action
+        except GeneratorExit:
+            # 呼叫端提前停止：保存已收到的部分回應
+            self._finish_turn(scanner.buffer)
+            raise
+        except BaseException:
+            # 請求失敗：移除本輪的用戶訊息，不留下空白的助手訊息
+            # （API 不接受空白內容，否則之後每次請求都會失敗）
+            self.conversation_history.pop()
+            raise
+        else:
+            self._finish_turn(scanner.buffer)
+
+        if not yielded:
+            # 沒有可串流的操作物件，退回完整解析
+            yield from self._parse_response(scanner.buffer)
+        elif parse_error:
+            yield BrowserAction(
+                action_type=ActionType.CUSTOM_SCRIPT,
+                description=scanner.buffer,
+                options={"raw_response": scanner.buffer, "parse_error": str(parse_error)}
+            )
 
-        assistant_message = response.content[0].text
+    def record_turn(self, user_prompt: str, invoice_data: Optional[InvoiceData], reply: str):
+        """
+        不呼叫 API，直接將一輪對話記錄到歷史（用於快取命中的指令）
 
-        # 保存回應
+        Args:
+            user_prompt: 用戶指令
+            invoice_data: 可選的發票資料
+            reply: 該輪的助手回應文字
+        """
+        self._trim_history()
         self.conversation_history.append({
-            "role": "assistant",
-            "content": assistant_message
+            "role": "user",
+            "content": self._build_prompt(user_prompt, invoice_data)
         })
+        self._finish_turn(reply)
+
+    @staticmethod
+    def _build_prompt(user_prompt: str, invoice_data: Optional[InvoiceData]) -> str:
+        """構建完整提示（附上發票資料）"""
+        context = ""
+        if invoice_data:
+            context = f"\n\n當前發票資料:\n{json_utils.dumps(invoice_data.to_dict(), indent=True).decode('utf-8')}"
+
+        return user_prompt + context
+
+    def _trim_history(self):
+        """以完整輪次移除最舊的對話，讓加入本輪的兩則訊息後不超過上限"""
+        history = self.conversation_history
+        while len(history) > self.HISTORY_MAX_MESSAGES - 2:
+            history.popleft()
+            # 連同該輪的助手回應一起移除，視窗一定從用戶訊息開始
+            while history and history[0]["role"] != "user":
+                history.popleft()
+
+    def _finish_turn(self, reply: str):
+        """保存助手回應；沒有任何回應文字時移除本輪的用戶訊息"""
+        self.last_reply = reply
+        if reply:
+            self.conversation_history.append({
+                "role": "assistant",
+                "content": reply
+            })
+        else:
+            self.conversation_history.pop()
 
-        # 解析回應為操作
-        return self._parse_response(assistant_message)
+    def _cached_messages(self) -> List[Dict[str, Any]]:
+        """
+        複製對話歷史，並在最後兩則用戶訊息加上快取標記
+
+        最後一則標記讓下一輪請求沿用到本輪為止的前綴，倒數第二則
+        則命中上一輪寫入的快取。前綴未達快取最低長度時不標記；
+        連同系統提示共 3 個快取區塊，低於 API 上限 4 個。
+        對話歷史本身保持純文字。
+
+        Returns:
+            傳給 API 的訊息列表
+        """
+        messages: List[Dict[str, Any]] = list(self.conversation_history)
+
+        # 以字元數粗估 token 數（中文約一字一 token，英文會高估，只影響是否標記）
+        prefix_lengths = []
+        length = len(self.SYSTEM_PROMPT)
+        for message in messages:
+            length += len(message["content"])
+            prefix_lengths.append(length)
+
+        user_indices = [i for i, m in enumerate(messages) if m["role"] == "user"]
+        for i in user_indices[-2:]:
+            if prefix_lengths[i] < self._MIN_CACHE_TOKENS:
+                continue
+            messages[i] = {
+                "role": messages[i]["role"],
+                "content": [{
+                    "type": "text",
+                    "text": messages[i]["content"],
+                    "cache_control": self._CACHE_CONTROL,
+                }],
+            }
+        return messages
+
+    @staticmethod
+    def _action_from_dict(action_dict: Dict[str, Any]) -> BrowserAction:
+        """將 Claude 輸出的操作物件轉為 BrowserAction（操作類型無效時拋出 ValueError）"""
+        value = action_dict.get("action_type", "custom_script")
+        action_type = _ACTION_TYPE_MAP.get(value) if isinstance(value, str) else None
+        if action_type is None:
+            raise ValueError(f"{value!r} is not a valid ActionType")
+        return BrowserAction(
+            action_type=action_type,
+            target=action_dict.get("target"),
+            value=action_dict.get("value"),
+            description=action_dict.get("description", ""),
+            wait_after=action_dict.get("wait_after", 0.5)
+        )
 
     def _parse_response(self, response: str) -> List[BrowserAction]:
         """解析 Claude 回應為操作列表"""
         actions = []
 
         # 嘗試提取 JSON
-        json_match = re.search(r'\[[\s\S]*\]', response)
-        if json_match:
+        json_array = _extract_json_array(response)
+        if json_array:
             try:
-                action_list = json.loads(json_match.group())
+                action_list = json_utils.loads(json_array)
                 for action_dict in action_list:
-                    action_type = ActionType(action_dict.get("action_type", "custom_script"))
-                    actions.append(BrowserAction(
-                        action_type=action_type,
-                        target=action_dict.get("target"),
-                        value=action_dict.get("value"),
-                        description=action_dict.get("description", ""),
-                        wait_after=action_dict.get("wait_after", 0.5)
-                    ))
+                    actions.append(self._action_from_dict(action_dict))
             except (json.JSONDecodeError, ValueError) as e:
                 # 如果 JSON 解析失敗，創建一個自定義操作
                 actions.append(BrowserAction(
@@ -358,7 +755,7 @@ class ClaudeAutomationAgent:
 
     def clear_history(self):
         """清除對話歷史"""
-        self.conversation_history = []
+        self.conversation_history.clear()
 
 
 class AIBrowserController:
@@ -368,10 +765,24 @@ class AIBrowserController:
     整合 AI 指令解析和瀏覽器自動化
     """
 
+    # Claude 指令解析結果快取的最大筆數
+    ACTION_CACHE_SIZE = 128
+
+    # 滾動方向 -> 對應的 JavaScript
+    _SCROLL_SCRIPTS = {
+        "up": "window.scrollBy(0, -500);",
+        "down": "window.scrollBy(0, 500);",
+        "bottom": "window.scrollTo(0, document.body.scrollHeight);",
+        "到底": "window.scrollTo(0, document.body.scrollHeight);",
+        "top": "window.scrollTo(0, 0);",
+        "頂部": "window.scrollTo(0, 0);",
+    }
+
     def __init__(self,
                  use_claude: bool = False,
                  api_key: Optional[str] = None,
-                 browser_config: Optional[BrowserConfig] = None):
+                 browser_config: Optional[BrowserConfig] = None,
+                 browser: Optional[EInvoiceAutomation] = None):
         """
         初始化控制器
 
@@ -379,8 +790,9 @@ class AIBrowserController:
             use_claude: 是否使用 Claude API
             api_key: Claude API 金鑰
             browser_config: 瀏覽器配置
+            browser: 沿用的瀏覽器控制器（可為已啟動的瀏覽器，指定時忽略 browser_config）
         """
-        self.browser = EInvoiceAutomation(browser_config)
+        self.browser = browser or EInvoiceAutomation(browser_config)
         self.local_parser = AICommandParser()
 
         self.use_claude = use_claude
@@ -394,6 +806,9 @@ class AIBrowserController:
                 self.use_claude = False
 
         self.session: Optional[AutomationSession] = None
+        # Claude 解析結果快取：鍵 -> (操作序列, 助手回應文字)
+        self._action_cache: "OrderedDict[str, Tuple[List[BrowserAction], str]]" = OrderedDict()
+        self._next_ready_at = 0.0
         self.action_handlers: Dict[ActionType, Callable] = self._setup_handlers()
 
     def _setup_handlers(self) -> Dict[ActionType, Callable]:
@@ -419,15 +834,22 @@ class AIBrowserController:
         self.session = AutomationSession(
             session_id=session_id or str(uuid.uuid4())[:8]
         )
-        self.browser.start_browser()
+        if not self.browser.is_running:
+            self.browser.start_browser()
         self.session.status = "running"
         return self.session
 
-    def end_session(self):
-        """結束會話"""
+    def end_session(self, close_browser: bool = True):
+        """
+        結束會話
+
+        Args:
+            close_browser: 是否關閉瀏覽器（保留給下一個會話沿用時為 False）
+        """
         if self.session:
             self.session.status = "completed"
-        self.browser.close_browser()
+        if close_browser:
+            self.browser.close_browser()
 
     def process_prompt(self, prompt: str,
                        invoice_data: Optional[InvoiceData] = None) -> Dict[str, Any]:
@@ -439,7 +861,8 @@ class AIBrowserController:
             invoice_data: 發票資料
 
         Returns:
-            執行結果
+            執行結果（actions 為已產生的 BrowserAction 列表，操作失敗時不含
+            未產生的後續操作；輸出成 JSON 前以 serialize_result 轉換）
         """
         result = {
             "success": False,
@@ -450,35 +873,93 @@ class AIBrowserController:
         }
 
         try:
-            # 解析指令
-            if self.use_claude and self.claude_agent:
-                actions = self.claude_agent.generate_actions(prompt, invoice_data)
-            else:
-                actions = self.local_parser.parse_command(prompt)
-
-            result["actions"] = [a.to_dict() for a in actions]
-
             # 確保瀏覽器已啟動
-            if not self.browser.driver:
+            if not self.browser.is_running:
                 self.start_session()
 
-            # 執行操作
+            # 邊解析邊執行：使用 Claude 時第一個操作生成後即開始執行
+            actions = self.iter_actions(prompt, invoice_data)
             for action in actions:
+                result["actions"].append(action)
                 action_result = self.execute_action(action, invoice_data)
                 result["results"].append(action_result)
 
                 if not action_result.get("success", False):
+                    # 停止產生剩餘操作：中斷 Claude 串流，不再等待與計費，
+                    # 不完整的序列也不會寫入快取
+                    actions.close()
                     result["message"] = f"操作失敗: {action_result.get('error', '未知錯誤')}"
                     return result
 
             result["success"] = True
-            result["message"] = f"成功執行 {len(actions)} 個操作"
+            result["message"] = f"成功執行 {len(result['actions'])} 個操作"
 
         except Exception as e:
             result["message"] = f"執行錯誤: {str(e)}"
 
         return result
 
+    def parse_actions(self, prompt: str,
+                      invoice_data: Optional[InvoiceData] = None) -> List[BrowserAction]:
+        """
+        解析指令為操作序列，使用 Claude 時相同指令與發票資料直接取用快取
+
+        Args:
+            prompt: 自然語言指令
+            invoice_data: 發票資料
+
+        Returns:
+            操作序列（快取內容的副本，執行時修改不影響快取）
+        """
+        return list(self.iter_actions(prompt, invoice_data))
+
+    def iter_actions(self, prompt: str,
+                     invoice_data: Optional[InvoiceData] = None) -> Iterator[BrowserAction]:
+        """
+        逐一產出指令的操作，使用 Claude 時隨串流回應產出
+
+        只快取 Claude 的解析結果（本地規則解析只需幾微秒，計算快取鍵與複製結果
+        反而更慢）。快取命中時仍將這一輪記錄到對話歷史，之後的指令保有完整上下文。
+        完整產出後才寫入快取，呼叫端中途停止時不快取不完整的序列。
+
+        Args:
+            prompt: 自然語言指令
+            invoice_data: 發票資料
+
+        Yields:
+            瀏覽器操作（使用 Claude 時為快取內容的副本）
+        """
+        if not (self.use_claude and self.claude_agent):
+            yield from self.local_parser.parse_command(prompt)
+            return
+
+        invoice_json = json.dumps(invoice_data.to_dict(), sort_keys=True) if invoice_data else ""
+        key = hashlib.blake2b(
+            f"{prompt}|{invoice_json}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+        cached = self._action_cache.get(key)
+        if cached is not None:
+            self._action_cache.move_to_end(key)
+            actions, reply = cached
+            self.claude_agent.record_turn(prompt, invoice_data, reply)
+            yield from copy.deepcopy(actions)
+            return
+
+        source = self.claude_agent.stream_actions(prompt, invoice_data)
+        actions = []
+        try:
+            for action in source:
+                actions.append(copy.deepcopy(action))
+                yield action
+        finally:
+            # 呼叫端提前停止時立即關閉來源（結束 Claude 的串流連線）
+            source.close()
+
+        self._action_cache[key] = (actions, self.claude_agent.last_reply)
+        if len(self._action_cache) > self.ACTION_CACHE_SIZE:
+            self._action_cache.popitem(last=False)
+
     def execute_action(self, action: BrowserAction,
                        invoice_data: Optional[InvoiceData] = None) -> Dict[str, Any]:
         """
@@ -491,6 +972,12 @@ class AIBrowserController:
         Returns:
             執行結果
         """
+        # 上一個操作的等待時間從它結束時起算，期間已花掉的時間（例如等待
+        # 串流回應的下一個操作）不必再等
+        delay = self._next_ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
         handler = self.action_handlers.get(action.action_type)
 
         if handler:
@@ -501,13 +988,42 @@ class AIBrowserController:
                 "error": f"不支援的操作類型: {action.action_type}"
             }
 
-        # 操作後等待
-        if action.wait_after > 0:
-            time.sleep(action.wait_after)
+        # 操作後等待：記錄下一個操作最早可執行的時間，到時再補足
+        self._next_ready_at = time.monotonic() + max(action.wait_after, 0)
 
         return result
 
     # 操作處理器實現
+    def _find_target(self, target: str, match_text: bool = False, timeout: int = 5):
+        """
+        以單次查詢定位操作目標
+
+        id、name（及元素文字）合併為一個 XPath 聯集，避免逐一嘗試時
+        每種方式各等待一次超時；只由標籤名稱組成的選擇器（"button"、"form input"）
+        以等價的 XPath 併入聯集。含其他 CSS 語法的目標先以 CSS 查詢，
+        找不到時再以 XPath 聯集快速檢查一次（例如含「.」的連結文字）。
+
+        Args:
+            target: CSS 選擇器、元素 id/name 或按鈕文字
+            match_text: 是否比對元素文字、按鈕、連結文字與 input 的 value
+            timeout: 超時時間（秒）
+
+        Returns:
+            找到的元素，找不到時返回 None
+        """
+        xpath = _target_xpath(target, match_text)
+
+        if _CSS_SYNTAX_RE.search(target):
+            try:
+                return self.browser.wait_for_element(By.CSS_SELECTOR, target, timeout=timeout)
+            except Exception:
+                timeout = 1
+
+        try:
+            return self.browser.wait_for_element(By.XPATH, xpath, timeout=timeout)
+        except Exception:
+            return None
+
     def _handle_navigate(self, action: BrowserAction,
                          invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理導航操作"""
@@ -521,25 +1037,7 @@ class AIBrowserController:
                       invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理點擊操作"""
         try:
-            from selenium.webdriver.common.by import By
-
-            # 嘗試多種定位方式（使用更精確的選擇器）
-            element = None
-            selectors = [
-                (By.CSS_SELECTOR, action.target),
-                (By.XPATH, f"//button[normalize-space(.) = '{action.target}']"
-                           f" | //a[normalize-space(.) = '{action.target}']"
-                           f" | //input[@value = '{action.target}']"),
-                (By.ID, action.target),
-                (By.NAME, action.target),
-            ]
-
-            for by, selector in selectors:
-                try:
-                    element = self.browser.wait_for_element(by, selector, timeout=5)
-                    break
-                except Exception:
-                    continue
+            element = self._find_target(action.target, match_text=True)
 
             if element:
                 self.browser.safe_click(element)
@@ -554,21 +1052,7 @@ class AIBrowserController:
                      invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理輸入操作"""
         try:
-            from selenium.webdriver.common.by import By
-
-            element = None
-            selectors = [
-                (By.CSS_SELECTOR, action.target),
-                (By.ID, action.target),
-                (By.NAME, action.target),
-            ]
-
-            for by, selector in selectors:
-                try:
-                    element = self.browser.wait_for_element(by, selector, timeout=5)
-                    break
-                except Exception:
-                    continue
+            element = self._find_target(action.target)
 
             if element:
                 self.browser.safe_send_keys(element, action.value)
@@ -593,7 +1077,7 @@ class AIBrowserController:
                            invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理截圖操作"""
         try:
-            filename = action.value or f"screenshot_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+            filename = action.value or default_screenshot_filename()
             self.browser.take_screenshot(filename)
             return {"success": True, "filename": filename}
         except Exception as e:
@@ -626,8 +1110,8 @@ class AIBrowserController:
         """處理填表操作"""
         if invoice_data:
             try:
-                success = self.browser.fill_invoice_form(invoice_data)
-                return {"success": success, "message": "表單填寫完成" if success else "填寫失敗"}
+                missing = self.browser.fill_invoice_form_batched(invoice_data)
+                return {"success": True, "message": "表單填寫完成", "missing_fields": missing}
             except Exception as e:
                 return {"success": False, "error": str(e)}
         else:
@@ -637,8 +1121,6 @@ class AIBrowserController:
                        invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理提交操作"""
         try:
-            from selenium.webdriver.common.by import By
-
             # 嘗試找到提交按鈕
             submit_selectors = [
                 "button[type='submit']",
@@ -647,15 +1129,16 @@ class AIBrowserController:
                 "#submitBtn",
             ]
 
-            for selector in submit_selectors:
-                try:
-                    element = self.browser.wait_for_element(By.CSS_SELECTOR, selector, timeout=3)
-                    self.browser.safe_click(element)
-                    return {"success": True, "message": "表單已提交"}
-                except Exception:
-                    continue
+            # 合併為單一選擇器，只需一次查詢與一次等待
+            try:
+                element = self.browser.wait_for_element(
+                    By.CSS_SELECTOR, ", ".join(submit_selectors), timeout=5
+                )
+            except Exception:
+                return {"success": False, "error": "找不到提交按鈕"}
 
-            return {"success": False, "error": "找不到提交按鈕"}
+            self.browser.safe_click(element)
+            return {"success": True, "message": "表單已提交"}
 
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -666,14 +1149,9 @@ class AIBrowserController:
         try:
             direction = action.value or "down"
 
-            if direction == "up":
-                self.browser.execute_script("window.scrollBy(0, -500);")
-            elif direction == "down":
-                self.browser.execute_script("window.scrollBy(0, 500);")
-            elif direction in ("bottom", "到底"):
-                self.browser.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            elif direction in ("top", "頂部"):
-                self.browser.execute_script("window.scrollTo(0, 0);")
+            script = self._SCROLL_SCRIPTS.get(direction)
+            if script:
+                self.browser.execute_script(script)
 
             return {"success": True, "direction": direction}
 
@@ -684,10 +1162,30 @@ class AIBrowserController:
                        invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理下拉選擇操作"""
         try:
-            from selenium.webdriver.common.by import By
+            element = self.browser.wait_for_element(By.CSS_SELECTOR, action.target, timeout=5)
+
+            if self.browser.cdp:
+                # nodriver 元素無法交給 selenium 的 Select，直接在頁面中選取並觸發事件
+                error = self.browser.execute_script(
+                    "const el = document.querySelector(arguments[0]);"
+                    " if (!el || el.tagName !== 'SELECT') return '不是下拉選單: ' + arguments[0];"
+                    " const options = Array.from(el.options);"
+                    " const option = options.find(o => o.text.trim() === arguments[1])"
+                    " || options.find(o => o.value === arguments[1]);"
+                    " if (!option) return '找不到選項: ' + arguments[1];"
+                    " el.value = option.value;"
+                    " el.dispatchEvent(new Event('input', {bubbles: true}));"
+                    " el.dispatchEvent(new Event('change', {bubbles: true}));"
+                    " return null;",
+                    action.target,
+                    action.value,
+                )
+                if error:
+                    return {"success": False, "error": error}
+                return {"success": True, "target": action.target, "value": action.value}
+
             from selenium.webdriver.support.ui import Select
 
-            element = self.browser.wait_for_element(By.CSS_SELECTOR, action.target, timeout=5)
             select = Select(element)
 
             # 嘗試用文字選擇
@@ -706,10 +1204,12 @@ class AIBrowserController:
                         invoice_data: Optional[InvoiceData]) -> Dict[str, Any]:
         """處理資料提取操作"""
         try:
-            from selenium.webdriver.common.by import By
-
-            elements = self.browser.driver.find_elements(By.CSS_SELECTOR, action.target)
-            data = [el.text for el in elements]
+            # 單次執行腳本取回所有文字，不需對每個元素各發一次 .text 請求
+            data = self.browser.execute_script(
+                "return Array.from(document.querySelectorAll(arguments[0]),"
+                " el => el.innerText.trim());",
+                action.target,
+            ) or []
 
             return {"success": True, "data": data}
 
@@ -729,10 +1229,34 @@ class AIBrowserController:
         }
 
 
+def serialize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    將 process_prompt 的結果轉為可 JSON 序列化的字典
+
+    操作只在需要輸出時才轉為字典，執行過程中不必為每個操作建立副本。
+
+    Args:
+        result: process_prompt 返回的結果
+
+    Returns:
+        actions 已轉為字典列表的淺複本
+    """
+    actions = result.get("actions")
+    if not actions:
+        return result
+    return {
+        **result,
+        "actions": [a.to_dict() if isinstance(a, BrowserAction) else a for a in actions],
+    }
+
+
 # 方便的工廠函數
 def create_ai_controller(use_claude: bool = False,
                          api_key: Optional[str] = None,
-                         headless: bool = False) -> AIBrowserController:
+                         headless: bool = False,
+                         backend: str = "selenium",
+                         debugger_address: Optional[str] = None,
+                         browser: Optional[EInvoiceAutomation] = None) -> AIBrowserController:
     """
     創建 AI 控制器
 
@@ -740,13 +1264,21 @@ def create_ai_controller(use_claude: bool = False,
         use_claude: 是否使用 Claude API
         api_key: API 金鑰
         headless: 是否使用無頭模式
+        backend: 瀏覽器後端（selenium / nodriver / auto）
+        debugger_address: 連接既有 Chrome 的除錯位址（host:port）
+        browser: 沿用的瀏覽器控制器（指定時忽略其他瀏覽器設定）
 
     Returns:
         AIBrowserController 實例
     """
-    config = BrowserConfig(headless=headless)
+    config = BrowserConfig(
+        headless=headless,
+        backend=backend,
+        debugger_address=debugger_address
+    )
     return AIBrowserController(
         use_claude=use_claude,
         api_key=api_key,
-        browser_config=config
+        browser_config=config,
+        browser=browser
     )
@@ -2,31 +2,80 @@
 瀏覽器自動化模組 - Chrome 瀏覽器控制
 用於自動登入財政部電子發票平台並填寫發票資料
 """
+import base64
+import json
+import shutil
+import subprocess
+import tempfile
 import time
-from typing import Optional
+from typing import Any, Optional
 from dataclasses import dataclass
 
-try:
-    from selenium import webdriver
-    from selenium.webdriver.chrome.service import Service
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.common.keys import Keys
-    from selenium.webdriver.support.ui import WebDriverWait, Select
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.common.exceptions import (
-        TimeoutException,
-        NoSuchElementException,
-        WebDriverException,
-    )
-except ImportError:
-    webdriver = None
+# selenium 與 webdriver-manager 載入成本高，延後到第一次使用 selenium 後端時
+# 才由 _load_selenium() 填入以下名稱；只解析發票的程式不需付出這筆成本
+webdriver = None
+Service = None
+Options = None
+WebDriverWait = None
+ChromeDriverManager = None
+TimeoutException = TimeoutError
+
+# 等待條件名稱 -> expected_conditions 函數（由 _load_selenium() 填入）
+_CONDITIONS: dict = {}
+
+
+class By:
+    """定位方式常數（與 selenium 的 By 相同，不需載入 selenium 即可使用）"""
+    ID = "id"
+    XPATH = "xpath"
+    LINK_TEXT = "link text"
+    PARTIAL_LINK_TEXT = "partial link text"
+    NAME = "name"
+    TAG_NAME = "tag name"
+    CLASS_NAME = "class name"
+    CSS_SELECTOR = "css selector"
+
+
+def _load_selenium():
+    """
+    載入 selenium 與 webdriver-manager 並填入模組層級名稱
+
+    Raises:
+        ImportError: 未安裝 selenium 或 webdriver-manager
+    """
+    global webdriver, Service, Options, WebDriverWait, ChromeDriverManager, TimeoutException
+    if webdriver is not None and ChromeDriverManager is not None:
+        return
+
+    try:
+        from selenium import webdriver as _webdriver
+        from selenium.webdriver.chrome.service import Service as _Service
+        from selenium.webdriver.chrome.options import Options as _Options
+        from selenium.webdriver.support.ui import WebDriverWait as _WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException as _TimeoutException
+    except ImportError:
+        raise ImportError("請安裝 selenium: pip install selenium") from None
+
+    Service = _Service
+    Options = _Options
+    WebDriverWait = _WebDriverWait
+    TimeoutException = _TimeoutException
+    _CONDITIONS.update({
+        "presence": EC.presence_of_element_located,
+        "clickable": EC.element_to_be_clickable,
+        "visible": EC.visibility_of_element_located,
+    })
+    webdriver = _webdriver
+
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager as _ChromeDriverManager
+    except ImportError:
+        raise ImportError("請安裝 webdriver-manager: pip install webdriver-manager") from None
+    ChromeDriverManager = _ChromeDriverManager
 
-try:
-    from webdriver_manager.chrome import ChromeDriverManager
-except ImportError:
-    ChromeDriverManager = None
 
+from .cdp_browser import CDPBrowser, nodriver
 from .invoice_extractor import InvoiceData
 
 
@@ -39,6 +88,69 @@ class BrowserConfig:
     implicit_wait: int = 10
     page_load_timeout: int = 30
     download_dir: Optional[str] = None
+    backend: str = "selenium"  # 瀏覽器後端：selenium / nodriver / auto（優先使用 nodriver）
+    debugger_address: Optional[str] = None  # 連接既有 Chrome 的除錯位址，如 "127.0.0.1:9222"
+
+
+def default_screenshot_filename() -> str:
+    """產生以當前時間命名的截圖檔名（screenshot_YYYYmmdd_HHMMSS.png）"""
+    t = time.localtime()
+    return (
+        f"screenshot_{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}"
+        f"_{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}.png"
+    )
+
+
+# 常見的 Chrome 執行檔名稱與路徑
+CHROME_CANDIDATES = (
+    "google-chrome",
+    "google-chrome-stable",
+    "chromium",
+    "chromium-browser",
+    "chrome",
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Google\Chrome\Application\chrome.exe",
+)
+
+
+def launch_debug_chrome(port: int = 9222, headless: bool = False,
+                        user_data_dir: Optional[str] = None) -> subprocess.Popen:
+    """
+    啟動一個開啟遠端除錯埠的 Chrome，供多次執行共用
+
+    Args:
+        port: 遠端除錯埠
+        headless: 是否使用無頭模式
+        user_data_dir: 使用者資料目錄（遠端除錯需使用非預設目錄）
+
+    Returns:
+        Chrome 程序
+    """
+    for candidate in CHROME_CANDIDATES:
+        executable = shutil.which(candidate)
+        if executable:
+            break
+    else:
+        raise FileNotFoundError("找不到 Chrome 瀏覽器執行檔")
+
+    args = [
+        executable,
+        f"--remote-debugging-port={port}",
+        f"--user-data-dir={user_data_dir or tempfile.mkdtemp(prefix='invoice-chrome-')}",
+        "--no-first-run",
+        "--no-default-browser-check",
+    ]
+    if headless:
+        args.append("--headless=new")
+
+    # 脫離目前的程序群組，讓 Chrome 在指令結束後繼續執行
+    return subprocess.Popen(
+        args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
 
 
 class BrowserAutomation:
@@ -48,6 +160,16 @@ class BrowserAutomation:
     用於控制 Chrome 瀏覽器自動完成發票申報作業
     """
 
+    # fill_invoice_form 的欄位 id 與找不到時的提示（範例，需依實際網站調整）
+    _INVOICE_FIELD_IDS = {
+        "invoiceNumber": "找不到發票號碼欄位",
+        "invoiceDate": "找不到發票日期欄位",
+        "sellerTaxId": "找不到賣方統編欄位",
+        "buyerTaxId": "找不到買方統編欄位",
+        "totalAmount": "找不到金額欄位",
+        "taxAmount": "找不到稅額欄位",
+    }
+
     # 財政部電子發票整合服務平台
     EINVOICE_URL = "https://www.einvoice.nat.gov.tw/"
 
@@ -61,26 +183,64 @@ class BrowserAutomation:
         Args:
             config: 瀏覽器配置
         """
-        self._check_dependencies()
         self.config = config or BrowserConfig()
-        self.driver: Optional[webdriver.Chrome] = None
+        self.backend = self._resolve_backend(self.config.backend)
+        self._check_dependencies()
+        self.driver: Optional["webdriver.Chrome"] = None
+        self.cdp: Optional[CDPBrowser] = None
+        # 依超時秒數快取的 WebDriverWait（綁定目前的 driver，關閉瀏覽器時清除）
+        self._wait_cache: dict[float, "WebDriverWait"] = {}
+        # 是否已切換進 iframe（Runtime.evaluate 只作用於頂層頁面）
+        self._in_frame = False
+
+    @staticmethod
+    def _resolve_backend(backend: str) -> str:
+        """解析瀏覽器後端，auto 時優先使用 nodriver"""
+        if backend == "auto":
+            return "nodriver" if nodriver is not None else "selenium"
+        return backend
+
+    @property
+    def is_attached(self) -> bool:
+        """是否連接到既有的瀏覽器（而非自行啟動）"""
+        return bool(self.config.debugger_address)
+
+    @property
+    def is_running(self) -> bool:
+        """瀏覽器是否已啟動"""
+        return self.driver is not None or self.cdp is not None
 
     def _check_dependencies(self):
         """檢查必要的套件"""
-        if webdriver is None:
-            raise ImportError("請安裝 selenium: pip install selenium")
-        if ChromeDriverManager is None:
-            raise ImportError("請安裝 webdriver-manager: pip install webdriver-manager")
+        if self.backend == "nodriver":
+            if nodriver is None:
+                raise ImportError("請安裝 nodriver: pip install nodriver")
+            return
+        _load_selenium()
 
-    def start_browser(self) -> webdriver.Chrome:
+    def start_browser(self):
         """
         啟動 Chrome 瀏覽器
 
         Returns:
-            webdriver.Chrome: Chrome 瀏覽器實例
+            webdriver.Chrome 或 CDPBrowser: 瀏覽器實例
         """
+        if self.backend == "nodriver":
+            return self._start_cdp_browser()
+
+        _load_selenium()
+        self._wait_cache.clear()
+        self._in_frame = False
         options = Options()
 
+        if self.is_attached:
+            # 連接既有的 Chrome，其餘啟動參數不適用
+            options.add_experimental_option("debuggerAddress", self.config.debugger_address)
+            service = Service(ChromeDriverManager().install())
+            self.driver = webdriver.Chrome(service=service, options=options)
+            self.driver.set_page_load_timeout(self.config.page_load_timeout)
+            return self.driver
+
         # 基本設定
         if self.config.headless:
             options.add_argument("--headless=new")
@@ -113,11 +273,68 @@ class BrowserAutomation:
 
         return self.driver
 
+    def _start_cdp_browser(self) -> CDPBrowser:
+        """透過 nodriver 啟動 Chrome（直接使用 CDP，不經過 chromedriver）"""
+        browser_args = [
+            f"--window-size={self.config.window_width},{self.config.window_height}",
+            "--disable-gpu",
+            "--disable-dev-shm-usage",
+        ]
+        self.cdp = CDPBrowser(
+            headless=self.config.headless,
+            browser_args=browser_args,
+            debugger_address=self.config.debugger_address,
+        )
+        self.cdp.start()
+        return self.cdp
+
     def close_browser(self):
         """關閉瀏覽器"""
+        if self.cdp:
+            self.cdp.stop()
+            self.cdp = None
         if self.driver:
-            self.driver.quit()
+            if self.is_attached:
+                # 只停止 chromedriver，保留使用者啟動的瀏覽器
+                self.driver.service.stop()
+            else:
+                self.driver.quit()
             self.driver = None
+            self._wait_cache.clear()
+
+    def reset_state(self) -> bool:
+        """
+        關閉多餘的分頁、清除 cookie、快取與平台網站的儲存資料並回到空白頁
+
+        其他網站的儲存資料與瀏覽歷史不會清除，重設後的瀏覽器只應交給
+        同一個使用者的下一個會話沿用。只支援自行啟動的 selenium 瀏覽器
+        （nodriver 後端或連接既有瀏覽器時不重設）。
+
+        Returns:
+            bool: 是否重設成功（瀏覽器已關閉或無回應時為 False）
+        """
+        if not self.driver or self.is_attached:
+            return False
+        try:
+            # 關閉會話期間開啟的其他分頁與視窗
+            handles = self.driver.window_handles
+            for handle in handles[1:]:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.driver.switch_to.window(handles[0])
+
+            self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            self.driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            for url in (self.EINVOICE_URL, self.ETAX_URL):
+                self.driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin",
+                    {"origin": url.rstrip("/"), "storageTypes": "all"},
+                )
+            self.driver.get("about:blank")
+        except Exception:
+            return False
+        self._in_frame = False
+        return True
 
     def navigate_to(self, url: str):
         """
@@ -126,9 +343,12 @@ class BrowserAutomation:
         Args:
             url: 目標網址
         """
-        if not self.driver:
+        if not self.is_running:
             self.start_browser()
-        self.driver.get(url)
+        if self.cdp:
+            self.cdp.get(url)
+        else:
+            self.driver.get(url)
 
     def wait_for_element(
         self,
@@ -149,18 +369,24 @@ class BrowserAutomation:
         Returns:
             找到的元素
         """
-        wait = WebDriverWait(self.driver, timeout)
+        if self.cdp:
+            try:
+                return self.cdp.find(by, value, timeout=timeout)
+            except TimeoutError as e:
+                raise TimeoutException(str(e)) from e
 
-        conditions = {
-            "presence": EC.presence_of_element_located,
-            "clickable": EC.element_to_be_clickable,
-            "visible": EC.visibility_of_element_located,
-        }
+        wait = self._wait_cache.get(timeout)
+        if wait is None:
+            wait = self._wait_cache[timeout] = WebDriverWait(self.driver, timeout)
 
-        return wait.until(conditions[condition]((by, value)))
+        return wait.until(_CONDITIONS[condition]((by, value)))
 
     def safe_click(self, element):
         """安全點擊元素"""
+        if self.cdp:
+            self.cdp.click(element)
+            return
+
         try:
             element.click()
         except Exception:
@@ -176,10 +402,35 @@ class BrowserAutomation:
             text: 要輸入的文字
             clear_first: 是否先清空
         """
+        if self.cdp:
+            self.cdp.send_keys(element, text, clear_first)
+            return
+
         if clear_first:
             element.clear()
         element.send_keys(text)
 
+    def _resolve_fields(self, field_ids: list[str]) -> dict[str, Any]:
+        """
+        以單次腳本呼叫依 id 取得多個元素（selenium 後端）
+
+        Args:
+            field_ids: 元素 id 列表
+
+        Returns:
+            元素 id 對應 WebElement；頁面上找不到的 id 或 nodriver 後端時不包含
+        """
+        if not self.driver or not field_ids:
+            return {}
+        elements = self.driver.execute_script(
+            "return arguments[0].map(id => document.getElementById(id));", field_ids
+        )
+        return {
+            field_id: element
+            for field_id, element in zip(field_ids, elements)
+            if element is not None
+        }
+
     def fill_invoice_form(self, invoice_data: InvoiceData) -> bool:
         """
         填寫發票表單
@@ -196,66 +447,26 @@ class BrowserAutomation:
         try:
             # 注意：以下是範例代碼，實際的元素定位需要
             # 根據財政部網站的實際 HTML 結構進行調整
+            values = {
+                "invoiceNumber": invoice_data.invoice_number,
+                "invoiceDate": invoice_data.invoice_date,
+                "sellerTaxId": invoice_data.seller_id,
+                "buyerTaxId": invoice_data.buyer_id,
+                "totalAmount": str(invoice_data.total_amount) if invoice_data.total_amount > 0 else "",
+                "taxAmount": str(invoice_data.tax_amount) if invoice_data.tax_amount > 0 else "",
+            }
+            values = {field_id: value for field_id, value in values.items() if value}
 
-            # 填寫發票號碼
-            if invoice_data.invoice_number:
-                try:
-                    invoice_num_field = self.wait_for_element(
-                        By.ID, "invoiceNumber", timeout=5
-                    )
-                    self.safe_send_keys(invoice_num_field, invoice_data.invoice_number)
-                except TimeoutException:
-                    print("找不到發票號碼欄位")
-
-            # 填寫發票日期
-            if invoice_data.invoice_date:
-                try:
-                    date_field = self.wait_for_element(
-                        By.ID, "invoiceDate", timeout=5
-                    )
-                    self.safe_send_keys(date_field, invoice_data.invoice_date)
-                except TimeoutException:
-                    print("找不到發票日期欄位")
-
-            # 填寫賣方統一編號
-            if invoice_data.seller_id:
-                try:
-                    seller_id_field = self.wait_for_element(
-                        By.ID, "sellerTaxId", timeout=5
-                    )
-                    self.safe_send_keys(seller_id_field, invoice_data.seller_id)
-                except TimeoutException:
-                    print("找不到賣方統編欄位")
-
-            # 填寫買方統一編號
-            if invoice_data.buyer_id:
-                try:
-                    buyer_id_field = self.wait_for_element(
-                        By.ID, "buyerTaxId", timeout=5
-                    )
-                    self.safe_send_keys(buyer_id_field, invoice_data.buyer_id)
-                except TimeoutException:
-                    print("找不到買方統編欄位")
-
-            # 填寫金額
-            if invoice_data.total_amount > 0:
-                try:
-                    amount_field = self.wait_for_element(
-                        By.ID, "totalAmount", timeout=5
-                    )
-                    self.safe_send_keys(amount_field, str(invoice_data.total_amount))
-                except TimeoutException:
-                    print("找不到金額欄位")
-
-            # 填寫稅額
-            if invoice_data.tax_amount > 0:
+            # 已在頁面上的欄位一次取得，尚未出現的再個別等待
+            elements = self._resolve_fields(list(values))
+            for field_id, value in values.items():
                 try:
-                    tax_field = self.wait_for_element(
-                        By.ID, "taxAmount", timeout=5
-                    )
-                    self.safe_send_keys(tax_field, str(invoice_data.tax_amount))
+                    element = elements.get(field_id)
+                    if element is None:
+                        element = self.wait_for_element(By.ID, field_id, timeout=5)
+                    self.safe_send_keys(element, value)
                 except TimeoutException:
-                    print("找不到稅額欄位")
+                    print(self._INVOICE_FIELD_IDS[field_id])
 
             return True
 
@@ -263,34 +474,117 @@ class BrowserAutomation:
             print(f"填寫表單時發生錯誤: {e}")
             return False
 
+    def screenshot_bytes(self, fmt: str = "jpeg", quality: int = 70) -> bytes:
+        """
+        擷取螢幕截圖並直接返回影像內容（不寫入檔案）
+
+        直接呼叫 CDP Page.captureScreenshot，可選擇 JPEG 以大幅縮小資料量。
+
+        Args:
+            fmt: 影像格式（jpeg, png, webp）
+            quality: 壓縮品質 0-100（png 不適用）
+
+        Returns:
+            影像 bytes，瀏覽器未啟動時返回空 bytes
+        """
+        if self.cdp:
+            return self.cdp.capture_screenshot(fmt, quality)
+        if self.driver:
+            params = {"format": fmt}
+            if fmt != "png":
+                params["quality"] = quality
+            data = self.driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"]
+            return base64.b64decode(data)
+        return b""
+
     def take_screenshot(self, filename: str):
         """
         擷取螢幕截圖
 
         Args:
-            filename: 檔案名稱
+            filename: 檔案名稱（依副檔名決定格式，.jpg/.jpeg 為 JPEG，其餘為 PNG）
         """
+        if not self.is_running:
+            return
+
+        fmt = "jpeg" if filename.lower().endswith((".jpg", ".jpeg")) else "png"
+        with open(filename, "wb") as f:
+            f.write(self.screenshot_bytes(fmt=fmt))
+
+    def get_page_info(self) -> dict:
+        """取得當前頁面網址與標題（單次瀏覽器往返）"""
+        if self.cdp:
+            return self.cdp.page_info()
         if self.driver:
-            self.driver.save_screenshot(filename)
+            return self.driver.execute_script(
+                "return {url: location.href, title: document.title};"
+            )
+        return {}
 
     def get_page_source(self) -> str:
         """取得頁面原始碼"""
+        if self.cdp:
+            return self.cdp.evaluate("document.documentElement.outerHTML")
         return self.driver.page_source if self.driver else ""
 
     def execute_script(self, script: str, *args):
-        """執行 JavaScript"""
+        """
+        執行 JavaScript
+
+        腳本沿用 Selenium 的寫法（以 arguments[n] 取參數、return 回傳值），
+        nodriver 後端會包成函式後透過 Runtime.evaluate 執行。
+        """
+        if self.cdp:
+            return self.cdp.evaluate(self._script_expression(script, args))
         if self.driver:
             return self.driver.execute_script(script, *args)
 
+    @staticmethod
+    def _script_expression(script: str, args) -> str:
+        """將 Selenium 寫法的腳本與 JSON 參數包成單一 JavaScript 運算式"""
+        return f"(function() {{ {script} }}).apply(null, {json.dumps(list(args), ensure_ascii=False)})"
+
+    def _cdp_eval(self, expression: str):
+        """
+        以 CDP Runtime.evaluate 執行 JavaScript 運算式並取回值（selenium 後端）
+
+        不經過 chromedriver 的 execute/sync 腳本包裝與參數轉換，
+        但只作用於頂層頁面，不受 switch_to_frame 影響。
+
+        Raises:
+            RuntimeError: 腳本執行時拋出例外
+        """
+        response = self.driver.execute_cdp_cmd(
+            "Runtime.evaluate", {"expression": expression, "returnByValue": True}
+        )
+        details = response.get("exceptionDetails")
+        if details:
+            message = details.get("exception", {}).get("description") or details.get("text")
+            raise RuntimeError(f"JavaScript 執行失敗: {message}")
+        return response["result"].get("value")
+
+    def _evaluate_json_script(self, script: str, *args):
+        """
+        執行只使用 JSON 參數的腳本
+
+        頂層頁面兩種後端都以單次 Runtime.evaluate 執行；
+        已切換進 iframe 時退回 execute_script 以保留 frame 範圍。
+        """
+        if self.driver and not self._in_frame:
+            return self._cdp_eval(self._script_expression(script, args))
+        return self.execute_script(script, *args)
+
     def switch_to_frame(self, frame_reference):
         """切換到 iframe"""
         if self.driver:
             self.driver.switch_to.frame(frame_reference)
+            self._in_frame = True
 
     def switch_to_default_content(self):
         """切換回主頁面"""
         if self.driver:
             self.driver.switch_to.default_content()
+            self._in_frame = False
 
 
 class EInvoiceAutomation(BrowserAutomation):
@@ -300,9 +594,122 @@ class EInvoiceAutomation(BrowserAutomation):
     專門用於財政部電子發票整合服務平台的自動化操作
     """
 
+    # 表單欄位 selector（範例，需依財政部網站實際 HTML 結構調整）
+    FORM_FIELD_SELECTORS = {
+        "invoice_number": "#invoiceNumber",
+        "invoice_date": "#invoiceDate",
+        "seller_id": "#sellerTaxId",
+        "buyer_id": "#buyerTaxId",
+        "total_amount": "#totalAmount",
+        "tax_amount": "#taxAmount",
+    }
+
+    # 品項列 selector（範例）
+    ITEM_ROW_SELECTORS = {
+        "add_button": "#addItemBtn",
+        "row": ".invoice-item-row",
+        "name": "[name='itemName']",
+        "quantity": "[name='itemQuantity']",
+        "unit_price": "[name='itemUnitPrice']",
+        "amount": "[name='itemAmount']",
+    }
+
+    # 批次填寫腳本：在頁面內一次設定所有欄位、新增品項列並觸發 input/change 事件
+    _BATCH_FILL_JS = """
+        const [fields, items, rowSel] = arguments;
+        const missing = [];
+        const setValue = (el, val) => {
+            el.value = val;
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        };
+        for (const [sel, val] of Object.entries(fields)) {
+            const el = document.querySelector(sel);
+            if (el) { setValue(el, val); } else { missing.push(sel); }
+        }
+        for (const item of items) {
+            const addButton = document.querySelector(rowSel.add_button);
+            if (addButton) { addButton.click(); }
+            const rows = document.querySelectorAll(rowSel.row);
+            const row = rows[rows.length - 1];
+            if (!row) { missing.push(rowSel.row); break; }
+            for (const [key, val] of Object.entries(item)) {
+                const el = row.querySelector(rowSel[key]);
+                if (el) { setValue(el, val); } else { missing.push(rowSel[key]); }
+            }
+        }
+        return missing;
+    """
+
     def __init__(self, config: Optional[BrowserConfig] = None):
         super().__init__(config)
 
+    def invoice_form_data(self, invoice_data: InvoiceData) -> tuple[dict, list[dict]]:
+        """
+        將發票資料轉換為批次填寫用的欄位資料
+
+        Args:
+            invoice_data: 發票資料
+
+        Returns:
+            (selector 對應欄位值, 品項列資料)
+        """
+        values = {
+            "invoice_number": invoice_data.invoice_number,
+            "invoice_date": invoice_data.invoice_date,
+            "seller_id": invoice_data.seller_id,
+            "buyer_id": invoice_data.buyer_id,
+            "total_amount": str(invoice_data.total_amount) if invoice_data.total_amount > 0 else "",
+            "tax_amount": str(invoice_data.tax_amount) if invoice_data.tax_amount > 0 else "",
+        }
+        fields = {
+            self.FORM_FIELD_SELECTORS[key]: value
+            for key, value in values.items()
+            if value
+        }
+        items = [
+            {
+                "name": item.name,
+                "quantity": str(item.quantity),
+                "unit_price": str(item.unit_price),
+                "amount": str(item.amount),
+            }
+            for item in invoice_data.items
+        ]
+        return fields, items
+
+    def fill_invoice_form_batch(self, data: dict, items: Optional[list[dict]] = None) -> list[str]:
+        """
+        以單次腳本呼叫批次填寫發票表單
+
+        所有欄位與品項列在同一次 Runtime.evaluate 中完成（位於 iframe 時為
+        execute_script），取代逐欄位的瀏覽器往返。
+
+        Args:
+            data: CSS selector 對應欄位值
+            items: 品項列資料（欄位名稱對應值）
+
+        Returns:
+            找不到的 selector 列表
+        """
+        missing = self._evaluate_json_script(
+            self._BATCH_FILL_JS, data, items or [], self.ITEM_ROW_SELECTORS
+        )
+        return missing or []
+
+    def fill_invoice_form_batched(self, invoice_data: InvoiceData) -> list[str]:
+        """
+        以單次腳本呼叫填寫發票資料（欄位與品項列）
+
+        Args:
+            invoice_data: 發票資料
+
+        Returns:
+            找不到的 selector 列表
+        """
+        fields, items = self.invoice_form_data(invoice_data)
+        return self.fill_invoice_form_batch(fields, items)
+
     def open_einvoice_platform(self):
         """開啟電子發票平台"""
         self.navigate_to(self.EINVOICE_URL)
@@ -368,8 +775,13 @@ class EInvoiceAutomation(BrowserAutomation):
             bool: 是否提交成功
         """
         # 填寫表單
-        if not self.fill_invoice_form(invoice_data):
+        try:
+            missing = self.fill_invoice_form_batched(invoice_data)
+        except Exception as e:
+            print(f"填寫表單時發生錯誤: {e}")
             return False
+        if missing:
+            print(f"找不到以下欄位: {', '.join(missing)}")
 
         # 此處添加提交邏輯
         # 注意：實際提交前應該有確認步驟
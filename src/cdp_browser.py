@@ -0,0 +1,166 @@
+"""
+CDP 瀏覽器模組 - 透過 nodriver 直接以 Chrome DevTools Protocol 控制瀏覽器
+
+nodriver 以 websocket 直接和 Chrome 溝通，不經過 chromedriver 的
+HTTP 轉送，每個操作只需一次 CDP 往返。
+"""
+import asyncio
+import base64
+import json
+import threading
+from typing import Any, Optional
+
+try:
+    import nodriver
+except ImportError:
+    nodriver = None
+
+
+class CDPBrowser:
+    """
+    nodriver 同步封裝
+
+    nodriver 為全非同步 API，這裡在背景執行緒維持一個事件迴圈，
+    讓 websocket 監聽持續運作，並對外提供同步方法。
+    """
+
+    def __init__(self, headless: bool = False, browser_args: Optional[list[str]] = None,
+                 debugger_address: Optional[str] = None):
+        """
+        初始化 CDP 瀏覽器
+
+        Args:
+            headless: 是否使用無頭模式
+            browser_args: 額外的 Chrome 啟動參數
+            debugger_address: 連接既有 Chrome 的除錯位址（host:port），
+                設定時不啟動新的瀏覽器
+        """
+        if nodriver is None:
+            raise ImportError("請安裝 nodriver: pip install nodriver")
+
+        self.headless = headless
+        self.browser_args = list(browser_args or [])
+        self.debugger_address = debugger_address
+        self.browser = None
+        self.tab = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """在背景事件迴圈執行協程並等待結果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def start(self):
+        """啟動 Chrome 並取得主分頁"""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="cdp-loop", daemon=True
+        )
+        self._thread.start()
+
+        if self.debugger_address:
+            host, port = self.debugger_address.rsplit(":", 1)
+            self.browser = self.run(nodriver.start(host=host, port=int(port)))
+        else:
+            self.browser = self.run(nodriver.start(
+                headless=self.headless,
+                browser_args=self.browser_args,
+            ))
+        self.tab = self.browser.main_tab
+        return self.tab
+
+    def stop(self):
+        """關閉瀏覽器並停止事件迴圈"""
+        if self.browser:
+            self.run(self._stop_browser())
+            self.browser = None
+            self.tab = None
+
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+    async def _stop_browser(self):
+        if self.debugger_address:
+            # 連接既有瀏覽器時只中斷 websocket，不關閉瀏覽器
+            await self.browser.connection.aclose()
+            return
+        # Browser.stop() 會在當前事件迴圈排程關閉連線，需在迴圈執行緒內呼叫
+        self.browser.stop()
+        await asyncio.sleep(0)
+
+    def get(self, url: str):
+        """導航到指定網址"""
+        self.tab = self.run(self.tab.get(url))
+
+    def evaluate(self, expression: str) -> Any:
+        """以 Runtime.evaluate 執行 JavaScript 並取回值"""
+        return self.run(self.tab.evaluate(expression, return_by_value=True))
+
+    def capture_screenshot(self, fmt: str = "jpeg", quality: Optional[int] = 70) -> bytes:
+        """
+        以 Page.captureScreenshot 擷取截圖
+
+        Args:
+            fmt: 影像格式（jpeg, png, webp）
+            quality: 壓縮品質（png 不適用）
+
+        Returns:
+            影像 bytes
+        """
+        command = nodriver.cdp.page.capture_screenshot(
+            format_=fmt,
+            quality=quality if fmt != "png" else None,
+        )
+        return base64.b64decode(self.run(self.tab.send(command)))
+
+    def page_info(self) -> dict:
+        """取得當前頁面網址與標題（網址取自本地 target 資訊）"""
+        return {
+            "url": self.tab.target.url,
+            "title": self.evaluate("document.title"),
+        }
+
+    def find(self, by: str, value: str, timeout: float = 10):
+        """
+        依 Selenium 定位方式尋找元素
+
+        Args:
+            by: 定位方式（id, name, css selector, xpath, link text）
+            value: 定位值
+            timeout: 超時時間（秒）
+
+        Returns:
+            nodriver 元素
+
+        Raises:
+            TimeoutError: 超時仍找不到元素
+        """
+        if by == "xpath":
+            elements = self.run(self.tab.xpath(value, timeout=timeout))
+            if not elements:
+                raise TimeoutError(f"找不到元素: {value}")
+            return elements[0]
+
+        if by in ("link text", "partial link text"):
+            return self.run(self.tab.find(value, best_match=True, timeout=timeout))
+
+        if by == "id":
+            value = f"[id={json.dumps(value, ensure_ascii=False)}]"
+        elif by == "name":
+            value = f"[name={json.dumps(value, ensure_ascii=False)}]"
+
+        return self.run(self.tab.select(value, timeout=timeout))
+
+    def click(self, element):
+        """點擊元素"""
+        self.run(element.click())
+
+    def send_keys(self, element, text: str, clear_first: bool = True):
+        """在元素中輸入文字"""
+        if clear_first:
+            self.run(element.clear_input())
+        self.run(element.send_keys(text))
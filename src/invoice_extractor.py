@@ -1,15 +1,49 @@
 """
 發票識別模組 - 判別發票項目與金額
 """
+import copy
+import os
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 from pathlib import Path
 
 from .pdf_parser import PDFParser, PDFContent
 
 
-@dataclass
+# 預先編譯的正則表達式（模組載入時編譯一次）
+_RE_INVOICE_NUM = re.compile(r"[A-Z]{2}[-\s]?\d{8}")
+_RE_TAX_ID = re.compile(r"\b\d{8}\b")
+_RE_DATE_TW = re.compile(r"(\d{2,3})\s*[年/]\s*(\d{1,2})\s*[月/]\s*(\d{1,2})\s*日?")
+_RE_DATE_WESTERN = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+
+# 金額欄位
+_RE_TOTAL = re.compile(r"(?:合計|總計|總額|應付|Total)[^\d]*([\d,]+(?:\.\d{2})?)", re.IGNORECASE)
+_RE_TAX = re.compile(r"(?:營業稅|稅額|稅金|Tax)[^\d]*([\d,]+(?:\.\d{2})?)", re.IGNORECASE)
+_RE_SUBTOTAL = re.compile(r"(?:小計|未稅|銷售額|Subtotal)[^\d]*([\d,]+(?:\.\d{2})?)", re.IGNORECASE)
+
+# 解析金額前要移除的字元（千分位逗號、空白、全形空白、貨幣符號），一次 translate 完成
+_AMOUNT_STRIP = str.maketrans("", "", ", \t\u3000$¥")
+
+# 品項表格欄位關鍵字（每個欄位一個交替模式，一次掃描比對所有關鍵字）
+_RE_COL_NAME = re.compile(r"品名|品項|項目|商品|名稱")
+_RE_COL_QTY = re.compile(r"數量|數|Qty")
+_RE_COL_PRICE = re.compile(r"單價|價格|Price")
+_RE_COL_AMOUNT = re.compile(r"金額|小計|Amount")
+
+# 常見的公司名稱模式
+_RE_COMPANY = (
+    re.compile(r"([\u4e00-\u9fff]+(?:股份有限公司|有限公司|公司|企業|行號|商行|工廠|事務所))"),
+    re.compile(r"賣方[：:]\s*([\u4e00-\u9fff]+)"),
+    re.compile(r"買方[：:]\s*([\u4e00-\u9fff]+)"),
+    re.compile(r"營業人[：:]\s*([\u4e00-\u9fff]+)"),
+)
+
+
+@dataclass(slots=True)
 class InvoiceItem:
     """發票品項"""
     name: str  # 品名
@@ -22,7 +56,7 @@ class InvoiceItem:
             self.amount = self.quantity * self.unit_price
 
 
-@dataclass
+@dataclass(slots=True)
 class InvoiceData:
     """發票資料結構"""
     # 發票基本資訊
@@ -91,7 +125,7 @@ class InvoiceData:
 class InvoiceExtractor:
     """發票資訊提取器"""
 
-    # 正則表達式模式
+    # 正則表達式模式（說明用，實際比對使用模組層級預先編譯的 _RE_* 常數）
     PATTERNS = {
         # 發票號碼：2碼英文 + 8碼數字
         "invoice_number": r"[A-Z]{2}[-\s]?\d{8}",
@@ -108,28 +142,202 @@ class InvoiceExtractor:
         "total_keywords": r"(合計|總計|總額|應付|Total)",
     }
 
-    def __init__(self):
-        self.pdf_parser = PDFParser()
+    # 文字層至少需要的字元數，不足時視為掃描版 PDF
+    MIN_TEXT_LENGTH = 200
+
+    # PDF 解析結果快取的最大筆數
+    RESULT_CACHE_SIZE = 128
+
+    def __init__(self, prefer_fast_text: bool = False):
+        """
+        初始化發票資訊提取器
+
+        Args:
+            prefer_fast_text: 以 PyMuPDF / PyPDF2 快速提取文字（見 PDFParser）
+        """
+        self.pdf_parser = PDFParser(prefer_fast_text=prefer_fast_text)
+        # (路徑, 修改時間, 檔案大小) -> 解析結果，extract_batch 會從多個執行緒存取
+        self._result_cache: "OrderedDict[tuple, InvoiceData]" = OrderedDict()
+        self._cache_lock = threading.Lock()
 
     def extract_from_pdf(self, file_path: str | Path) -> InvoiceData:
         """
         從 PDF 文件提取發票資訊
 
+        優先使用 PDF 文字層；只有文字層幾乎沒有文字（掃描版 PDF）時才改用 OCR。
+        同一個檔案（路徑、修改時間與大小皆相同）重複解析時直接返回快取結果的複本。
+
         Args:
             file_path: PDF 文件路徑
 
         Returns:
             InvoiceData: 提取的發票資料
         """
-        # 解析 PDF
+        try:
+            stat = Path(file_path).stat()
+        except OSError:
+            # 找不到檔案等錯誤交由 PDFParser 回報
+            return self._extract_from_pdf_uncached(file_path)
+
+        key = (str(file_path), stat.st_mtime_ns, stat.st_size)
+        with self._cache_lock:
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                self._result_cache.move_to_end(key)
+                return copy.deepcopy(cached)
+
+        invoice_data = self._extract_from_pdf_uncached(file_path)
+
+        with self._cache_lock:
+            self._result_cache[key] = copy.deepcopy(invoice_data)
+            if len(self._result_cache) > self.RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+
+        return invoice_data
+
+    def extract_from_stream(self, stream: BinaryIO, name: str = "") -> InvoiceData:
+        """
+        從已開啟的 PDF 串流提取發票資訊（例如上傳的檔案），不需先寫入磁碟
+
+        串流沒有路徑與修改時間可作為快取鍵，結果不會快取。
+
+        Args:
+            stream: 可 seek 的二進位串流
+            name: 文件名稱
+
+        Returns:
+            InvoiceData: 提取的發票資料
+        """
+        pdf_content = self.pdf_parser.parse_stream(stream, name)
+        return self._extract_with_ocr_fallback(pdf_content, stream)
+
+    def iter_from_stream(self, stream: BinaryIO,
+                         name: str = "") -> Iterator[tuple[int, int, InvoiceData, bool]]:
+        """
+        逐頁解析 PDF 串流，每解析完一頁就產生一次暫時的發票資訊
+
+        每頁只提取該頁的內容，補上先前頁面尚未找到的欄位並加入品項，
+        不重新掃描已解析的頁面。所有頁面解析完後，再以完整內容提取一次
+        （與 extract_from_stream 的結果相同，包含 OCR 備援）作為最後的結果。
+
+        Args:
+            stream: 可 seek 的二進位串流
+            name: 文件名稱
+
+        Yields:
+            (已解析頁數, 總頁數, 發票資料, 是否為最終結果)；
+            暫時結果為同一個持續更新的物件
+        """
+        pages = []
+        tables = []
+        total_pages = 0
+        partial = InvoiceData()
+        for page_content in self.pdf_parser.iter_stream_pages(stream, name):
+            total_pages = page_content.total_pages
+            pages.extend(page_content.pages)
+            tables.extend(page_content.tables)
+            self._merge_partial(partial, self._extract_from_content(page_content))
+            yield len(pages), total_pages, partial, False
+
+        pdf_content = PDFContent(
+            file_path=name, pages=pages, tables=tables, total_pages=total_pages
+        )
+        invoice_data = self._extract_with_ocr_fallback(pdf_content, stream)
+        yield len(pages), total_pages, invoice_data, True
+
+    def _merge_partial(self, partial: InvoiceData, page_data: InvoiceData):
+        """將單一頁面提取的欄位補進暫時結果（已找到的欄位不覆蓋），並重新計算信心度"""
+        for name in ("invoice_number", "invoice_date"):
+            if not getattr(partial, name):
+                setattr(partial, name, getattr(page_data, name))
+        for name in ("total_amount", "tax_amount", "subtotal"):
+            if not getattr(partial, name):
+                setattr(partial, name, getattr(page_data, name))
+
+        # 統一編號與公司名稱依出現順序分配給賣方、買方
+        for seller, buyer in (("seller_id", "buyer_id"), ("seller_name", "buyer_name")):
+            found = [v for v in (getattr(partial, seller), getattr(partial, buyer)) if v]
+            for value in (getattr(page_data, seller), getattr(page_data, buyer)):
+                if value and value not in found and len(found) < 2:
+                    found.append(value)
+            found += [""] * (2 - len(found))
+            setattr(partial, seller, found[0])
+            setattr(partial, buyer, found[1])
+
+        partial.items.extend(page_data.items)
+        partial.confidence = self._confidence(partial)
+
+    def _extract_from_pdf_uncached(self, file_path: str | Path) -> InvoiceData:
+        """解析 PDF 並提取發票資訊（不使用快取）"""
         pdf_content = self.pdf_parser.parse(file_path)
+        return self._extract_with_ocr_fallback(pdf_content, file_path)
 
+    def _extract_with_ocr_fallback(self, pdf_content: PDFContent,
+                                   source: str | Path | BinaryIO) -> InvoiceData:
+        """從 PDF 文字層提取發票資訊，文字層不足時改以 OCR 重新解析來源"""
         # 提取發票資訊
-        invoice_data = self._extract_invoice_data(pdf_content)
-        invoice_data.raw_text = pdf_content.raw_text
+        invoice_data = self._extract_from_content(pdf_content)
+
+        if self._has_usable_text_layer(pdf_content):
+            return invoice_data
+
+        # 文字層不足（掃描版發票），改用 OCR
+        ocr_data = self._extract_with_ocr(source)
+        if ocr_data is not None and ocr_data.confidence > invoice_data.confidence:
+            return ocr_data
 
         return invoice_data
 
+    def _extract_with_ocr(self, source: str | Path | BinaryIO) -> Optional[InvoiceData]:
+        """以 OCR 解析來源並提取發票資訊，無法 OCR 時回傳 None"""
+        try:
+            ocr_content = self.pdf_parser.parse_with_ocr(source)
+        except OSError:
+            # 系統未安裝 Tesseract（pytesseract.TesseractNotFoundError 為 OSError 的子類別），
+            # 保留文字層的結果
+            return None
+        if ocr_content is None:
+            return None
+        return self._extract_from_content(ocr_content)
+
+    def _extract_from_content(self, pdf_content: PDFContent) -> InvoiceData:
+        """從 PDF 內容（文字與表格）提取發票資訊"""
+        invoice_data = self._extract_invoice_data(pdf_content.raw_text, pdf_content.tables)
+        invoice_data.raw_text = pdf_content.raw_text
+        return invoice_data
+
+    def extract_batch(self, file_paths: list[str | Path], max_workers: int = 0) -> list[InvoiceData]:
+        """
+        以多個執行緒平行解析多張發票 PDF
+
+        PDFParser 不保存跨呼叫的狀態，每次解析各自開啟檔案，執行緒間不需加鎖。
+        執行緒適合讀檔與 OCR（tesseract 子程序）佔多數時間的批次；
+        pdfminer 的版面分析為純 Python，CPU 密集的大量批次請改用多程序
+        （見 main.parse_invoices）。
+
+        Args:
+            file_paths: PDF 文件路徑列表
+            max_workers: 最大執行緒數（0 表示依 CPU 核心數決定）
+
+        Returns:
+            list[InvoiceData]: 依輸入順序排列的發票資料
+        """
+        if len(file_paths) <= 1:
+            return [self.extract_from_pdf(path) for path in file_paths]
+
+        workers = max_workers or min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.extract_from_pdf, file_paths))
+
+    def _has_usable_text_layer(self, pdf_content: PDFContent) -> bool:
+        """
+        判斷 PDF 是否有文字層（只看文字量）
+
+        有足夠文字但找不到發票欄位的 PDF（非台灣發票或版面特殊）OCR 也無法改善，
+        不為此將每頁轉為影像辨識。
+        """
+        return len(pdf_content.raw_text.strip()) > self.MIN_TEXT_LENGTH
+
     def extract_from_text(self, text: str) -> InvoiceData:
         """
         從文字內容提取發票資訊
@@ -140,48 +348,42 @@ class InvoiceExtractor:
         Returns:
             InvoiceData: 提取的發票資料
         """
-        pdf_content = PDFContent(
-            file_path="",
-            pages=[text],
-            raw_text=text,
-            total_pages=1,
-        )
-        return self._extract_invoice_data(pdf_content)
+        # 純文字沒有表格，直接提取文字欄位，不需包裝成 PDFContent
+        return self._extract_invoice_data(text)
+
+    def _extract_invoice_data(self, text: str,
+                              tables: Optional[list[list]] = None) -> InvoiceData:
+        """
+        從文字與表格提取發票資訊
+
+        Args:
+            text: 發票完整文字
+            tables: PDF 表格（沒有表格時略過品項提取）
 
-    def _extract_invoice_data(self, pdf_content: PDFContent) -> InvoiceData:
-        """從 PDF 內容提取發票資訊"""
-        text = pdf_content.raw_text
+        Returns:
+            InvoiceData: 提取的發票資料
+        """
         invoice = InvoiceData()
-        matched_fields = 0
-        total_fields = 8  # 主要欄位數量
 
         # 提取發票號碼
         invoice.invoice_number = self._extract_invoice_number(text)
-        if invoice.invoice_number:
-            matched_fields += 1
 
         # 提取日期
         invoice.invoice_date = self._extract_date(text)
-        if invoice.invoice_date:
-            matched_fields += 1
 
         # 提取統一編號（賣方和買方）
         tax_ids = self._extract_tax_ids(text)
         if len(tax_ids) >= 1:
             invoice.seller_id = tax_ids[0]
-            matched_fields += 1
         if len(tax_ids) >= 2:
             invoice.buyer_id = tax_ids[1]
-            matched_fields += 1
 
         # 提取公司名稱
         names = self._extract_company_names(text)
         if len(names) >= 1:
             invoice.seller_name = names[0]
-            matched_fields += 1
         if len(names) >= 2:
             invoice.buyer_name = names[1]
-            matched_fields += 1
 
         # 提取金額
         amounts = self._extract_amounts(text)
@@ -189,24 +391,34 @@ class InvoiceExtractor:
             invoice.total_amount = amounts.get("total", 0)
             invoice.tax_amount = amounts.get("tax", 0)
             invoice.subtotal = amounts.get("subtotal", 0)
-            if invoice.total_amount > 0:
-                matched_fields += 1
 
         # 從表格提取品項
-        if pdf_content.tables:
-            invoice.items = self._extract_items_from_tables(pdf_content.tables)
-            if invoice.items:
-                matched_fields += 1
+        if tables:
+            invoice.items = self._extract_items_from_tables(tables)
 
         # 計算信心度
-        invoice.confidence = matched_fields / total_fields
+        invoice.confidence = self._confidence(invoice)
 
         return invoice
 
+    @staticmethod
+    def _confidence(invoice: InvoiceData) -> float:
+        """信心度：8 個主要欄位中已找到的比例"""
+        matched_fields = sum((
+            bool(invoice.invoice_number),
+            bool(invoice.invoice_date),
+            bool(invoice.seller_id),
+            bool(invoice.buyer_id),
+            bool(invoice.seller_name),
+            bool(invoice.buyer_name),
+            invoice.total_amount > 0,
+            bool(invoice.items),
+        ))
+        return matched_fields / 8
+
     def _extract_invoice_number(self, text: str) -> str:
         """提取發票號碼"""
-        pattern = self.PATTERNS["invoice_number"]
-        match = re.search(pattern, text)
+        match = _RE_INVOICE_NUM.search(text)
         if match:
             # 移除空格和連字符
             return match.group().replace(" ", "").replace("-", "")
@@ -215,8 +427,7 @@ class InvoiceExtractor:
     def _extract_date(self, text: str) -> str:
         """提取發票日期"""
         # 嘗試民國年格式
-        pattern_tw = self.PATTERNS["date_tw"]
-        match = re.search(pattern_tw, text)
+        match = _RE_DATE_TW.search(text)
         if match:
             year, month, day = match.groups()
             # 轉換民國年為西元年
@@ -226,8 +437,7 @@ class InvoiceExtractor:
             return f"{year}/{int(month):02d}/{int(day):02d}"
 
         # 嘗試西元年格式
-        pattern_western = self.PATTERNS["date_western"]
-        match = re.search(pattern_western, text)
+        match = _RE_DATE_WESTERN.search(text)
         if match:
             year, month, day = match.groups()
             return f"{year}/{int(month):02d}/{int(day):02d}"
@@ -235,59 +445,48 @@ class InvoiceExtractor:
         return ""
 
     def _extract_tax_ids(self, text: str) -> list[str]:
-        """提取統一編號"""
-        pattern = self.PATTERNS["tax_id"]
-        # 找出所有8位數字
-        matches = re.findall(pattern, text)
-
-        # 過濾掉可能是日期或其他數字的項目
+        """提取統一編號（只需要賣方和買方，找到兩個即停止掃描）"""
         valid_ids = []
-        for match in matches:
-            # 統一編號不會以 0 開頭太多位
-            if not match.startswith("000") and match not in valid_ids:
-                valid_ids.append(match)
+        for match in _RE_TAX_ID.finditer(text):
+            tax_id = match.group()
+            # 過濾掉可能是日期或其他數字的項目：統一編號不會以 0 開頭太多位
+            if not tax_id.startswith("000") and tax_id not in valid_ids:
+                valid_ids.append(tax_id)
+                if len(valid_ids) == 2:
+                    break
 
-        return valid_ids[:2]  # 只返回前兩個（賣方和買方）
+        return valid_ids
 
     def _extract_company_names(self, text: str) -> list[str]:
-        """提取公司名稱"""
+        """提取公司名稱（依模式優先順序，找到賣方與買方兩個即停止掃描）"""
         names = []
 
-        # 常見的公司名稱關鍵字
-        company_patterns = [
-            r"([\u4e00-\u9fff]+(?:股份有限公司|有限公司|公司|企業|行號|商行|工廠|事務所))",
-            r"賣方[：:]\s*([\u4e00-\u9fff]+)",
-            r"買方[：:]\s*([\u4e00-\u9fff]+)",
-            r"營業人[：:]\s*([\u4e00-\u9fff]+)",
-        ]
+        for pattern in _RE_COMPANY:
+            for match in pattern.finditer(text):
+                name = match.group(1)
+                if len(name) >= 2 and name not in names:
+                    names.append(name)
+                    if len(names) == 2:
+                        return names
 
-        for pattern in company_patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                if match and match not in names and len(match) >= 2:
-                    names.append(match)
-
-        return names[:2]
+        return names
 
     def _extract_amounts(self, text: str) -> dict[str, float]:
         """提取金額資訊"""
         amounts = {}
 
         # 尋找總計金額
-        total_pattern = r"(?:合計|總計|總額|應付|Total)[^\d]*([\d,]+(?:\.\d{2})?)"
-        total_match = re.search(total_pattern, text, re.IGNORECASE)
+        total_match = _RE_TOTAL.search(text)
         if total_match:
             amounts["total"] = self._parse_amount(total_match.group(1))
 
         # 尋找稅額
-        tax_pattern = r"(?:營業稅|稅額|稅金|Tax)[^\d]*([\d,]+(?:\.\d{2})?)"
-        tax_match = re.search(tax_pattern, text, re.IGNORECASE)
+        tax_match = _RE_TAX.search(text)
         if tax_match:
             amounts["tax"] = self._parse_amount(tax_match.group(1))
 
         # 尋找小計（未稅）
-        subtotal_pattern = r"(?:小計|未稅|銷售額|Subtotal)[^\d]*([\d,]+(?:\.\d{2})?)"
-        subtotal_match = re.search(subtotal_pattern, text, re.IGNORECASE)
+        subtotal_match = _RE_SUBTOTAL.search(text)
         if subtotal_match:
             amounts["subtotal"] = self._parse_amount(subtotal_match.group(1))
 
@@ -299,10 +498,8 @@ class InvoiceExtractor:
 
     def _parse_amount(self, amount_str: str) -> float:
         """解析金額字串"""
-        # 移除逗號和空格
-        clean_str = amount_str.replace(",", "").replace(" ", "")
         try:
-            return float(clean_str)
+            return float(amount_str.translate(_AMOUNT_STRIP))
         except ValueError:
             return 0.0
 
@@ -314,13 +511,13 @@ class InvoiceExtractor:
             if not table or len(table) < 2:
                 continue
 
-            # 尋找表頭
+            # 每個儲存格只轉一次字串（空儲存格為 ""），表頭偵測與資料列共用
+            rows = [[str(cell) if cell else "" for cell in row] if row else [] for row in table]
+
+            # 尋找表頭（以不會出現在關鍵字中的字元串接儲存格，避免跨格誤判）
             header_row = None
-            for i, row in enumerate(table):
-                if row and any(
-                    keyword in str(cell) for cell in row if cell
-                    for keyword in ["品名", "品項", "項目", "商品", "名稱"]
-                ):
+            for i, row in enumerate(rows):
+                if row and _RE_COL_NAME.search("\x01".join(cell for cell in row if cell)):
                     header_row = i
                     break
 
@@ -328,39 +525,39 @@ class InvoiceExtractor:
                 continue
 
             # 分析表頭以確定欄位位置
-            headers = [str(cell).strip() if cell else "" for cell in table[header_row]]
+            headers = [cell.strip() for cell in rows[header_row]]
 
-            name_col = self._find_column(headers, ["品名", "品項", "項目", "商品", "名稱"])
-            qty_col = self._find_column(headers, ["數量", "數", "Qty"])
-            price_col = self._find_column(headers, ["單價", "價格", "Price"])
-            amount_col = self._find_column(headers, ["金額", "小計", "Amount"])
+            name_col = self._find_column(headers, _RE_COL_NAME)
+            qty_col = self._find_column(headers, _RE_COL_QTY)
+            price_col = self._find_column(headers, _RE_COL_PRICE)
+            amount_col = self._find_column(headers, _RE_COL_AMOUNT)
 
             # 提取資料列
-            for row in table[header_row + 1:]:
+            for row in rows[header_row + 1:]:
                 if not row or len(row) <= name_col:
                     continue
 
-                name = str(row[name_col]).strip() if row[name_col] else ""
-                if not name or name == "":
+                name = row[name_col].strip()
+                if not name:
                     continue
 
                 item = InvoiceItem(name=name)
 
                 if qty_col is not None and len(row) > qty_col and row[qty_col]:
                     try:
-                        item.quantity = float(str(row[qty_col]).replace(",", ""))
+                        item.quantity = float(row[qty_col].translate(_AMOUNT_STRIP))
                     except ValueError:
                         pass
 
                 if price_col is not None and len(row) > price_col and row[price_col]:
                     try:
-                        item.unit_price = float(str(row[price_col]).replace(",", ""))
+                        item.unit_price = float(row[price_col].translate(_AMOUNT_STRIP))
                     except ValueError:
                         pass
 
                 if amount_col is not None and len(row) > amount_col and row[amount_col]:
                     try:
-                        item.amount = float(str(row[amount_col]).replace(",", ""))
+                        item.amount = float(row[amount_col].translate(_AMOUNT_STRIP))
                     except ValueError:
                         pass
 
@@ -368,12 +565,11 @@ class InvoiceExtractor:
 
         return items
 
-    def _find_column(self, headers: list[str], keywords: list[str]) -> Optional[int]:
-        """在表頭中尋找特定欄位"""
+    def _find_column(self, headers: list[str], keywords: re.Pattern) -> Optional[int]:
+        """在表頭中尋找第一個包含任一關鍵字的欄位"""
         for i, header in enumerate(headers):
-            for keyword in keywords:
-                if keyword in header:
-                    return i
+            if keywords.search(header):
+                return i
         return None
 
 
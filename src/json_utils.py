@@ -0,0 +1,40 @@
+"""
+JSON 工具 - 已安裝 orjson 時使用 orjson（C 實作），否則退回標準庫 json
+"""
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, indent: bool = False,
+          default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    序列化為 UTF-8 編碼的 JSON（保留中文字元，不轉為 \\u 跳脫）
+
+    Args:
+        obj: 要序列化的物件
+        indent: 是否以 2 格縮排輸出
+        default: 無法直接序列化的物件的轉換函數
+
+    Returns:
+        JSON bytes
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj, ensure_ascii=False, indent=2 if indent else None, default=default
+    ).encode("utf-8")
+
+
+def loads(data: str | bytes):
+    """解析 JSON 字串或 bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,20 +1,64 @@
 """
 PDF 解析模組 - 提取 PDF 發票內容
 """
+import importlib.util
+import io
 import re
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterator, Optional
 from dataclasses import dataclass, field
+from functools import cached_property
 
-try:
-    import pdfplumber
-except ImportError:
-    pdfplumber = None
+# pdfplumber、PyPDF2、PyMuPDF 與 pytesseract（會載入 PIL）載入成本高，
+# 模組載入時只確認是否已安裝，實際匯入延後到第一次使用時
+# （見 _load_pdfplumber / _load_pdf_reader / _load_fitz / _load_pytesseract）
+_HAS_PDFPLUMBER = importlib.util.find_spec("pdfplumber") is not None
+_HAS_PYPDF2 = importlib.util.find_spec("PyPDF2") is not None
+_HAS_PYMUPDF = importlib.util.find_spec("fitz") is not None
+_HAS_PYTESSERACT = importlib.util.find_spec("pytesseract") is not None
+pdfplumber = None
+PdfReader = None
+fitz = None
+pytesseract = None
 
-try:
-    from PyPDF2 import PdfReader
-except ImportError:
-    PdfReader = None
+
+def _load_pdfplumber():
+    """第一次使用時載入 pdfplumber"""
+    global pdfplumber
+    if pdfplumber is None:
+        import pdfplumber
+    return pdfplumber
+
+
+def _load_pdf_reader():
+    """第一次使用時載入 PyPDF2 的 PdfReader"""
+    global PdfReader
+    if PdfReader is None:
+        from PyPDF2 import PdfReader
+    return PdfReader
+
+
+def _load_fitz():
+    """第一次使用時載入 PyMuPDF（fitz）"""
+    global fitz
+    if fitz is None:
+        import fitz
+    return fitz
+
+
+def _load_pytesseract():
+    """第一次使用時載入 pytesseract"""
+    global pytesseract
+    if pytesseract is None:
+        import pytesseract
+    return pytesseract
+
+
+def _rewind(source: Path | BinaryIO) -> Path | BinaryIO:
+    """串流來源移回開頭後返回（同一個串流可能依序交給多個解析器讀取）"""
+    if not isinstance(source, Path):
+        source.seek(0)
+    return source
 
 
 @dataclass
@@ -24,22 +68,38 @@ class PDFContent:
     pages: list[str] = field(default_factory=list)
     tables: list[list] = field(default_factory=list)
     total_pages: int = 0
-    raw_text: str = ""
 
     def get_full_text(self) -> str:
         """取得完整文字內容"""
         return "\n".join(self.pages)
 
+    @cached_property
+    def raw_text(self) -> str:
+        """完整文字內容（第一次存取時才串接各頁，只使用 pages 時不產生整份文字的複本）"""
+        return self.get_full_text()
+
 
 class PDFParser:
     """PDF 解析器"""
 
-    def __init__(self):
+    def __init__(self, extract_tables: bool = True, prefer_fast_text: bool = False):
+        """
+        初始化 PDF 解析器
+
+        Args:
+            extract_tables: 是否提取表格（只需要文字時可關閉以加快解析）
+            prefer_fast_text: 以 PyMuPDF（未安裝時為 PyPDF2）提取文字（比 pdfplumber
+                的版面分析快，但文字排列可能不同），pdfplumber 只用於提取表格。
+                同時提取表格時 pdfplumber 仍會分析每一頁的線條，主要的加速只在
+                extract_tables=False 時
+        """
+        self.extract_tables = extract_tables
+        self.prefer_fast_text = prefer_fast_text
         self._check_dependencies()
 
     def _check_dependencies(self):
         """檢查必要的套件是否已安裝"""
-        if pdfplumber is None and PdfReader is None:
+        if not _HAS_PDFPLUMBER and not _HAS_PYPDF2 and not _HAS_PYMUPDF:
             raise ImportError(
                 "請安裝 PDF 解析套件: pip install pdfplumber PyPDF2"
             )
@@ -62,44 +122,170 @@ class PDFParser:
         if file_path.suffix.lower() != ".pdf":
             raise ValueError(f"不支援的文件格式: {file_path.suffix}")
 
+        return self._parse_source(file_path, str(file_path))
+
+    def parse_stream(self, stream: BinaryIO, name: str = "") -> PDFContent:
+        """
+        從已開啟的二進位串流解析 PDF（例如上傳的檔案），不需先寫入磁碟
+
+        Args:
+            stream: 可 seek 的二進位串流
+            name: 記錄在 PDFContent.file_path 的名稱
+
+        Returns:
+            PDFContent: 解析後的內容
+        """
+        return self._parse_source(stream, name)
+
+    def iter_stream_pages(self, stream: BinaryIO, name: str = "") -> Iterator[PDFContent]:
+        """
+        逐頁解析 PDF 串流，每解析完一頁就產生該頁的內容
+
+        Args:
+            stream: 可 seek 的二進位串流
+            name: 記錄在 PDFContent.file_path 的名稱
+
+        Yields:
+            PDFContent: 單一頁面的文字與表格（total_pages 為整份文件的頁數）
+        """
+        for total_pages, text, tables in self._iter_source_pages(stream):
+            yield PDFContent(
+                file_path=name,
+                pages=[text],
+                tables=tables,
+                total_pages=total_pages,
+            )
+
+    def _parse_source(self, source: Path | BinaryIO, name: str) -> PDFContent:
+        """解析所有頁面"""
+        content = PDFContent(file_path=name)
+        for total_pages, text, tables in self._iter_source_pages(source):
+            content.total_pages = total_pages
+            content.pages.append(text)
+            content.tables.extend(tables)
+        return content
+
+    def _iter_source_pages(self, source: Path | BinaryIO) -> Iterator[tuple[int, str, list]]:
+        """
+        依可用的套件選擇解析方式，逐頁解析
+
+        Yields:
+            (總頁數, 該頁文字, 該頁表格列表)
+        """
+        # 快速文字模式：PyMuPDF / PyPDF2 提取文字，需要表格時才使用 pdfplumber
+        if self.prefer_fast_text and (_HAS_PYMUPDF or _HAS_PYPDF2):
+            if not (self.extract_tables and _HAS_PDFPLUMBER):
+                yield from self._iter_text_only(source)
+                return
+
+            table_source = source
+            if not isinstance(source, Path):
+                # 兩個解析器交錯讀取，串流需各自一份
+                data = _rewind(source).read()
+                source, table_source = io.BytesIO(data), io.BytesIO(data)
+            for (total_pages, text, _), tables in zip(
+                self._iter_text_only(source), self._iter_pdfplumber_tables(table_source)
+            ):
+                yield total_pages, text, tables
+            return
+
         # 優先使用 pdfplumber（更好的表格解析能力）
-        if pdfplumber is not None:
-            return self._parse_with_pdfplumber(file_path)
+        if _HAS_PDFPLUMBER:
+            yield from self._iter_pdfplumber_pages(source)
         else:
-            return self._parse_with_pypdf2(file_path)
+            yield from self._iter_text_only(source)
 
-    def _parse_with_pdfplumber(self, file_path: Path) -> PDFContent:
-        """使用 pdfplumber 解析 PDF"""
-        content = PDFContent(file_path=str(file_path))
+    def _iter_text_only(self, source: Path | BinaryIO) -> Iterator[tuple[int, str, list]]:
+        """只提取文字（不含表格），優先使用最快的 PyMuPDF"""
+        if _HAS_PYMUPDF:
+            return self._iter_pymupdf_pages(source)
+        return self._iter_pypdf2_pages(source)
 
-        with pdfplumber.open(file_path) as pdf:
-            content.total_pages = len(pdf.pages)
+    def _iter_pdfplumber_pages(self, source: Path | BinaryIO) -> Iterator[tuple[int, str, list]]:
+        """使用 pdfplumber 逐頁解析 PDF"""
+        _load_pdfplumber()
+
+        with pdfplumber.open(_rewind(source)) as pdf:
+            total_pages = len(pdf.pages)
 
             for page in pdf.pages:
                 # 提取文字
                 text = page.extract_text() or ""
-                content.pages.append(text)
 
-                # 提取表格
-                tables = page.extract_tables()
-                if tables:
-                    content.tables.extend(tables)
+                # 提取表格：預設的 lines 策略只從線條與矩形找表格，
+                # 頁面沒有任何邊線時必定沒有表格，不必執行表格偵測
+                tables = []
+                if self.extract_tables and page.edges:
+                    tables = page.extract_tables() or []
 
-        content.raw_text = content.get_full_text()
-        return content
+                yield total_pages, text, tables
+
+    def _iter_pdfplumber_tables(self, source: Path | BinaryIO) -> Iterator[list[list]]:
+        """只使用 pdfplumber 逐頁提取表格（不做文字版面分析）"""
+        _load_pdfplumber()
+        with pdfplumber.open(_rewind(source)) as pdf:
+            for page in pdf.pages:
+                # 沒有邊線的頁面不會有 lines 策略的表格
+                yield page.extract_tables() if page.edges else []
 
-    def _parse_with_pypdf2(self, file_path: Path) -> PDFContent:
-        """使用 PyPDF2 解析 PDF（備用方案）"""
-        content = PDFContent(file_path=str(file_path))
+    def _iter_pypdf2_pages(self, source: Path | BinaryIO) -> Iterator[tuple[int, str, list]]:
+        """使用 PyPDF2 逐頁解析 PDF（備用方案）"""
+        _load_pdf_reader()
 
-        reader = PdfReader(str(file_path))
-        content.total_pages = len(reader.pages)
+        reader = PdfReader(str(source) if isinstance(source, Path) else _rewind(source))
+        total_pages = len(reader.pages)
 
         for page in reader.pages:
-            text = page.extract_text() or ""
-            content.pages.append(text)
+            yield total_pages, page.extract_text() or "", []
+
+    def _iter_pymupdf_pages(self, source: Path | BinaryIO) -> Iterator[tuple[int, str, list]]:
+        """使用 PyMuPDF 逐頁解析 PDF（C 實作的文字提取，速度最快）"""
+        _load_fitz()
+
+        if isinstance(source, Path):
+            doc = fitz.open(source)
+        else:
+            doc = fitz.open(stream=_rewind(source).read(), filetype="pdf")
+
+        with doc:
+            total_pages = doc.page_count
+            for page in doc:
+                yield total_pages, page.get_text("text"), []
+
+    def parse_with_ocr(self, file_path: str | Path | BinaryIO,
+                       lang: str = "chi_tra+eng") -> Optional[PDFContent]:
+        """
+        以 OCR 解析 PDF（用於沒有文字層的掃描版發票）
+
+        需要 pdfplumber、pytesseract 及系統上的 Tesseract。
+        OCR 需要將每頁轉為影像再辨識，速度遠慢於文字層解析，
+        僅應在文字層不足時使用。
+
+        Args:
+            file_path: PDF 文件路徑或可 seek 的二進位串流
+            lang: Tesseract 語言設定
+
+        Returns:
+            PDFContent，若 OCR 套件未安裝則返回 None
+        """
+        if not (_HAS_PDFPLUMBER and _HAS_PYTESSERACT):
+            return None
+        _load_pdfplumber()
+        _load_pytesseract()
+
+        if isinstance(file_path, (str, Path)):
+            source, name = Path(file_path), str(file_path)
+        else:
+            source, name = file_path, ""
+        content = PDFContent(file_path=name)
+
+        with pdfplumber.open(_rewind(source)) as pdf:
+            content.total_pages = len(pdf.pages)
+
+            for page in pdf.pages:
+                image = page.to_image(resolution=300).original
+                content.pages.append(pytesseract.image_to_string(image, lang=lang))
 
-        content.raw_text = content.get_full_text()
         return content
 
     def extract_text_blocks(self, file_path: str | Path) -> list[str]:
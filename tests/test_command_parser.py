@@ -0,0 +1,51 @@
+"""
+本地指令解析器測試
+
+執行方式：python -m unittest discover -s tests
+"""
+import unittest
+
+from src.ai_automation import ActionType, AICommandParser
+
+
+class CommandParserTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = AICommandParser()
+
+    def parse_types(self, command: str) -> list[ActionType]:
+        return [action.action_type for action in self.parser.parse_command(command)]
+
+    def test_keyword_commands_are_not_taken_as_navigation(self):
+        # 「到」也是導航關鍵字，不應搶走登入、提交、截圖操作
+        self.assertEqual(self.parse_types("登入到平台"), [ActionType.LOGIN])
+        self.assertEqual(self.parse_types("提交到系統"), [ActionType.SUBMIT])
+        self.assertEqual(self.parse_types("截圖到桌面"), [ActionType.SCREENSHOT])
+
+    def test_navigate_known_site(self):
+        actions = self.parser.parse_command("開啟電子發票平台")
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(actions[0].action_type, ActionType.NAVIGATE)
+        self.assertEqual(actions[0].value, "https://www.einvoice.nat.gov.tw/")
+
+    def test_navigate_url(self):
+        actions = self.parser.parse_command("前往 https://example.com")
+        self.assertEqual(actions[0].action_type, ActionType.NAVIGATE)
+        self.assertEqual(actions[0].value, "https://example.com")
+
+    def test_type_with_target(self):
+        actions = self.parser.parse_command("輸入 12345678 到 統一編號")
+        self.assertEqual(actions[0].action_type, ActionType.TYPE)
+        self.assertEqual(actions[0].value, "12345678")
+        self.assertEqual(actions[0].target, "統一編號")
+
+    def test_click_takes_precedence_over_login(self):
+        actions = self.parser.parse_command("點擊登入按鈕")
+        self.assertEqual(actions[0].action_type, ActionType.CLICK)
+        self.assertEqual(actions[0].target, "登入按鈕")
+
+    def test_unknown_command_becomes_custom_script(self):
+        self.assertEqual(self.parse_types("隨便說說"), [ActionType.CUSTOM_SCRIPT])
+
+
+if __name__ == "__main__":
+    unittest.main()
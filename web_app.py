@@ -8,28 +8,158 @@
 import os
 import json
 import base64
+import atexit
 import datetime
+import hashlib
+import io
+import multiprocessing
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
-from flask import Flask, request, render_template, jsonify, redirect, url_for
+from flask import Flask, Response, request, session, render_template, jsonify, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
 
 from config import UPLOAD_DIR, ALLOWED_EXTENSIONS
-from src import InvoiceExtractor
-from src.ai_automation import AIBrowserController, create_ai_controller
+from src import InvoiceExtractor, json_utils
+from src.ai_automation import AIBrowserController, create_ai_controller, serialize_result
+from src.browser_automation import BrowserConfig, EInvoiceAutomation
+from src.json_utils import dumps
 from src.invoice_extractor import InvoiceData
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """以 orjson 處理 jsonify 與 request.get_json（無法序列化的型別沿用 Flask 的轉換）"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return json_utils.loads(s)
+
+
 app = Flask(__name__)
+if json_utils.orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_DIR)
+# 簽署會話 cookie（未設定時每次啟動隨機產生，重新啟動後既有會話失效）
+app.secret_key = os.environ.get("FLASK_SECRET_KEY") or secrets.token_hex(32)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB 上限
 
-# 全域 AI 控制器實例（會話管理）
-ai_controller: Optional[AIBrowserController] = None
-current_invoice_data: Optional[InvoiceData] = None
+# 各使用者的 AI 控制器（以會話 cookie 中的 sid 區分）
+AI_SESSIONS: dict[str, AIBrowserController] = {}
+
+# 預先啟動、尚未被任何會話使用過的無頭瀏覽器，無頭模式的新會話直接取用，
+# 省去 Chrome 與 chromedriver 的啟動時間（有視窗的瀏覽器不預先開啟）。
+# 用過的瀏覽器無法完整清除其他網站的儲存資料與歷史紀錄，不交給其他使用者；
+# 取用後在背景啟動新的瀏覽器補回，程式結束時全部關閉
+BROWSER_POOL_SIZE = 2
+_idle_browsers: list[EInvoiceAutomation] = []
+_warming_browsers = 0
+_browser_pool_closed = False
+_idle_browsers_lock = threading.Lock()
+
+# 允許的副檔名（小寫）
+_ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
+
+# 解析 PDF 的程序池最多使用的子程序數
+PARSE_POOL_MAX_WORKERS = 4
+
+# 上傳內容 SHA-256 -> 解析結果，同一份 PDF 重複上傳時不再解析
+PARSE_CACHE_SIZE = 256
+_parse_cache: "OrderedDict[str, dict]" = OrderedDict()
+_parse_cache_lock = threading.Lock()
 
 
 def allowed_file(filename: str) -> bool:
-    """檢查文件類型是否允許"""
-    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+    """檢查文件類型是否允許（以字串運算取副檔名，規則與 Path.suffix 相同）"""
+    name = filename.rpartition("/")[2]
+    if name in ("", "."):
+        # 結尾為 / 或 /. 的罕見情況交給 Path 處理
+        name = Path(filename).name
+    dot = name.rfind(".")
+    return 0 < dot < len(name) - 1 and name[dot:].lower() in _ALLOWED_EXTENSIONS
+
+
+@lru_cache(maxsize=1)
+def _get_extractor() -> InvoiceExtractor:
+    """取得共用的發票識別器（每個解析程序第一次使用時建立）"""
+    return InvoiceExtractor()
+
+
+@lru_cache(maxsize=1)
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """
+    取得解析 PDF 用的程序池（第一次使用時建立）
+
+    PDF 版面分析為 CPU 密集的純 Python 程式，在請求執行緒中執行會互相爭用 GIL；
+    交給程序池後，多個上傳可以真正平行解析，請求執行緒只負責等待結果。
+    伺服器為多執行緒，直接 fork 可能複製到其他執行緒持有中的鎖而卡死，
+    因此以 forkserver（不支援時為 spawn）建立子程序。
+    """
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=min(os.cpu_count() or 1, PARSE_POOL_MAX_WORKERS),
+        mp_context=multiprocessing.get_context(start_method),
+    )
+
+
+def _parse_pdf_bytes(data: bytes, name: str) -> dict:
+    """程序池工作函數：解析 PDF 內容並返回發票資料字典"""
+    return _get_extractor().extract_from_stream(io.BytesIO(data), name).to_dict()
+
+
+def _has_pdf_header(stream) -> bool:
+    """檢查串流開頭是否有 PDF 標頭（規格允許標頭前有少量資料，檢查前 1024 bytes）"""
+    head = stream.read(1024)
+    stream.seek(0)
+    return b"%PDF-" in head
+
+
+def _stream_digest(stream) -> str:
+    """分段計算串流內容的 SHA-256，完成後移回開頭"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def parse_upload(file) -> dict:
+    """
+    解析上傳的發票 PDF（依內容雜湊快取結果）
+
+    Args:
+        file: 上傳的 FileStorage
+
+    Returns:
+        dict: 發票資料字典的複本（呼叫端可自行加入欄位）
+    """
+    key = _stream_digest(file.stream)
+    with _parse_cache_lock:
+        cached = _parse_cache.get(key)
+        if cached is not None:
+            _parse_cache.move_to_end(key)
+            return dict(cached)
+
+    data = file.stream.read()
+    try:
+        result = _get_parse_pool().submit(_parse_pdf_bytes, data, Path(file.filename).name).result()
+    except BrokenProcessPool:
+        # 子程序異常結束後程序池無法再使用，下次請求重新建立
+        _get_parse_pool.cache_clear()
+        raise
+
+    with _parse_cache_lock:
+        _parse_cache[key] = result
+        if len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+
+    return dict(result)
 
 
 @app.route("/")
@@ -49,19 +179,13 @@ def upload_file():
     if file.filename == "":
         return jsonify({"error": "沒有選擇文件"}), 400
 
-    if not allowed_file(file.filename):
+    if not allowed_file(file.filename) or not _has_pdf_header(file.stream):
         return jsonify({"error": "只支援 PDF 文件"}), 400
 
-    # 儲存文件
+    # 直接從上傳串流解析發票，不寫入暫存檔
     filename = Path(file.filename).name
-    filepath = UPLOAD_DIR / filename
-    file.save(str(filepath))
-
-    # 解析發票
     try:
-        extractor = InvoiceExtractor()
-        invoice_data = extractor.extract_from_pdf(str(filepath))
-        result = invoice_data.to_dict()
+        result = parse_upload(file)
         result["filename"] = filename
         result["success"] = True
 
@@ -82,18 +206,11 @@ def api_parse():
 
     file = request.files["file"]
 
-    if not allowed_file(file.filename):
+    if not allowed_file(file.filename) or not _has_pdf_header(file.stream):
         return jsonify({"error": "只支援 PDF 文件", "success": False}), 400
 
-    # 暫存文件
-    filename = Path(file.filename).name
-    filepath = UPLOAD_DIR / filename
-    file.save(str(filepath))
-
     try:
-        extractor = InvoiceExtractor()
-        invoice_data = extractor.extract_from_pdf(str(filepath))
-        result = invoice_data.to_dict()
+        result = parse_upload(file)
         result["success"] = True
 
         return jsonify(result)
@@ -104,10 +221,46 @@ def api_parse():
             "success": False
         }), 500
 
-    finally:
-        # 清理暫存文件
-        if filepath.exists():
-            filepath.unlink()
+
+@app.route("/api/parse/stream", methods=["POST"])
+def api_parse_stream():
+    """
+    API: 逐頁解析發票，以 Server-Sent Events 推送每頁解析後的暫時結果
+
+    每頁送出一個暫時結果，全部頁面解析完後再送出最終結果（與 /api/parse 相同）；
+    事件另含 page、total_pages 與 done，最終結果的 done 為 true。
+    逐頁結果需邊解析邊送出，無法經由程序池取回，因此在請求執行緒中解析，也不使用快取。
+    """
+    if "file" not in request.files:
+        return jsonify({"error": "沒有提供文件", "success": False}), 400
+
+    file = request.files["file"]
+
+    if not allowed_file(file.filename) or not _has_pdf_header(file.stream):
+        return jsonify({"error": "只支援 PDF 文件", "success": False}), 400
+
+    # 回應開始串流後請求的上傳檔案會被關閉，先讀入記憶體
+    data = file.stream.read()
+    filename = file.filename
+
+    def events():
+        try:
+            for page, total_pages, invoice_data, done in _get_extractor().iter_from_stream(
+                io.BytesIO(data), filename
+            ):
+                payload = invoice_data.to_dict()
+                payload.update(page=page, total_pages=total_pages, done=done, success=True)
+                yield _sse_event(payload)
+        except Exception as e:
+            yield _sse_event({"error": str(e), "success": False, "done": True})
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
+def _sse_event(payload: dict) -> str:
+    """將資料編碼為一個 Server-Sent Events 訊息"""
+    return f"data: {dumps(payload).decode('utf-8')}\n\n"
 
 
 @app.route("/health")
@@ -116,11 +269,170 @@ def health():
     return jsonify({"status": "ok"})
 
 
+def _session_id() -> str:
+    """取得目前使用者的會話 id（第一次存取時產生並存入 cookie）"""
+    sid = session.get("sid")
+    if sid is None:
+        sid = session["sid"] = secrets.token_hex(16)
+    return sid
+
+
+def _acquire_browser(headless: bool) -> Optional[EInvoiceAutomation]:
+    """取出一個預先啟動的全新無頭瀏覽器，沒有時返回 None；並在背景補足閒置池"""
+    if not headless:
+        return None
+    try:
+        while True:
+            with _idle_browsers_lock:
+                if not _idle_browsers:
+                    return None
+                browser = _idle_browsers.pop()
+            try:
+                browser.driver.current_url
+                return browser
+            except Exception:
+                # 閒置期間瀏覽器已關閉或無回應
+                _close_quietly(browser)
+    finally:
+        _refill_browser_pool()
+
+
+def _refill_browser_pool():
+    """在背景啟動無頭瀏覽器，補足閒置池（已在啟動中的也計入）"""
+    global _warming_browsers
+    with _idle_browsers_lock:
+        if _browser_pool_closed:
+            return
+        missing = BROWSER_POOL_SIZE - len(_idle_browsers) - _warming_browsers
+        if missing <= 0:
+            return
+        _warming_browsers += missing
+
+    for _ in range(missing):
+        threading.Thread(target=_warm_browser, name="browser-warmup", daemon=True).start()
+
+
+def _warm_browser():
+    """啟動一個新的無頭瀏覽器放入閒置池（失敗時略過，會話會自行啟動瀏覽器）"""
+    global _warming_browsers
+    browser = EInvoiceAutomation(BrowserConfig(headless=True))
+    try:
+        browser.start_browser()
+    except Exception:
+        app.logger.exception("Failed to pre-launch a browser for the idle pool")
+        browser = None
+
+    with _idle_browsers_lock:
+        _warming_browsers -= 1
+        if browser is not None and not _browser_pool_closed:
+            _idle_browsers.append(browser)
+            return
+    if browser is not None:
+        # 啟動期間程式已開始結束
+        _close_quietly(browser)
+
+
+def _close_quietly(browser: EInvoiceAutomation):
+    """關閉瀏覽器，忽略已關閉或無回應時的錯誤"""
+    try:
+        browser.close_browser()
+    except Exception:
+        pass
+
+
+@atexit.register
+def _close_idle_browsers():
+    """程式結束時關閉閒置池中的所有瀏覽器"""
+    global _browser_pool_closed
+    with _idle_browsers_lock:
+        _browser_pool_closed = True
+        browsers = _idle_browsers[:]
+        _idle_browsers.clear()
+    for browser in browsers:
+        _close_quietly(browser)
+
+
+def _release_controller(controller: AIBrowserController,
+                        keep_browser: bool = False) -> Optional[EInvoiceAutomation]:
+    """
+    結束會話
+
+    Args:
+        controller: 要結束的 AI 控制器
+        keep_browser: 是否保留瀏覽器（只用於同一個使用者接著開始的新會話）
+
+    Returns:
+        重設後保留的瀏覽器；未保留或重設失敗時關閉瀏覽器並返回 None
+    """
+    browser = controller.browser
+    if keep_browser and browser.reset_state():
+        controller.end_session(close_browser=False)
+        return browser
+    controller.end_session()
+    return None
+
+
+# 可用的 AI 指令說明（/api/ai/commands）
+AI_COMMANDS = [
+    {
+        "command": "開啟電子發票平台",
+        "description": "前往財政部電子發票整合服務平台",
+        "example": "開啟電子發票平台"
+    },
+    {
+        "command": "前往 [網址]",
+        "description": "導航到指定網址",
+        "example": "前往 https://www.einvoice.nat.gov.tw/"
+    },
+    {
+        "command": "點擊 [元素]",
+        "description": "點擊頁面上的按鈕或連結",
+        "example": "點擊 登入按鈕"
+    },
+    {
+        "command": "輸入 [文字] 到 [欄位]",
+        "description": "在輸入框中填入文字",
+        "example": "輸入 12345678 到 統一編號"
+    },
+    {
+        "command": "填寫發票資料",
+        "description": "使用解析的發票資料自動填表",
+        "example": "填寫發票資料"
+    },
+    {
+        "command": "等待 [秒數] 秒",
+        "description": "等待指定時間",
+        "example": "等待 3 秒"
+    },
+    {
+        "command": "截圖",
+        "description": "擷取當前頁面截圖",
+        "example": "截圖"
+    },
+    {
+        "command": "登入",
+        "description": "執行登入操作（需要帳號密碼）",
+        "example": "登入"
+    },
+    {
+        "command": "提交",
+        "description": "提交當前表單",
+        "example": "提交"
+    },
+    {
+        "command": "滾動 [方向]",
+        "description": "滾動頁面（上/下/到底）",
+        "example": "滾動到底"
+    }
+]
+_COMMANDS_JSON = dumps({"success": True, "commands": AI_COMMANDS})
+
+
 # ============ AI 自動化 API ============
 # 
 # 安全性警告：
 # 1. 這些端點目前缺少身份驗證和授權機制
-# 2. 全域變數非執行緒安全，不適合多用戶並發使用
+# 2. 各使用者以會話 cookie 區分控制器，但同一使用者的並發請求仍共用同一個瀏覽器
 # 3. 瀏覽器會話沒有自動清理機制（需手動停止或實作超時）
 # 4. 生產環境應實作：認證、速率限制、會話管理、輸入驗證
 # 
@@ -134,18 +446,21 @@ def start_ai_session():
         use_claude: bool - 是否使用 Claude API（需要設定 ANTHROPIC_API_KEY）
         headless: bool - 是否使用無頭模式
     """
-    global ai_controller
-
+    sid = _session_id()
     data = request.get_json() or {}
     use_claude = data.get("use_claude", False)
     headless = data.get("headless", False)
     api_key = data.get("api_key") or os.environ.get("ANTHROPIC_API_KEY")
 
     try:
-        # 如果已有會話，先結束
-        if ai_controller:
+        # 如果已有會話，先結束（同一個使用者的瀏覽器重設後沿用）
+        browser = None
+        previous = AI_SESSIONS.pop(sid, None)
+        if previous:
             try:
-                ai_controller.end_session()
+                browser = _release_controller(
+                    previous, keep_browser=previous.browser.config.headless == headless
+                )
             except Exception as e:
                 app.logger.exception("Failed to end existing AI session before starting a new one")
 
@@ -153,15 +468,17 @@ def start_ai_session():
         ai_controller = create_ai_controller(
             use_claude=use_claude,
             api_key=api_key,
-            headless=headless
+            headless=headless,
+            browser=browser or _acquire_browser(headless)
         )
 
         # 啟動會話
-        session = ai_controller.start_session()
+        ai_session = ai_controller.start_session()
+        AI_SESSIONS[sid] = ai_controller
 
         return jsonify({
             "success": True,
-            "session_id": session.session_id,
+            "session_id": ai_session.session_id,
             "message": "AI 自動化會話已啟動",
             "use_claude": use_claude
         })
@@ -176,11 +493,11 @@ def start_ai_session():
 @app.route("/api/ai/stop", methods=["POST"])
 def stop_ai_session():
     """停止 AI 瀏覽器自動化會話"""
-    global ai_controller
+    ai_controller = AI_SESSIONS.pop(_session_id(), None)
 
     if ai_controller:
         try:
-            ai_controller.end_session()
+            _release_controller(ai_controller)
             return jsonify({
                 "success": True,
                 "message": "會話已結束"
@@ -190,8 +507,6 @@ def stop_ai_session():
                 "success": False,
                 "error": str(e)
             }), 500
-        finally:
-            ai_controller = None
     else:
         return jsonify({
             "success": True,
@@ -208,8 +523,7 @@ def execute_ai_prompt():
         prompt: str - 自然語言指令
         invoice_data: dict - 可選的發票資料
     """
-    global ai_controller, current_invoice_data
-
+    sid = _session_id()
     data = request.get_json() or {}
     prompt = data.get("prompt", "").strip()
 
@@ -220,10 +534,14 @@ def execute_ai_prompt():
         }), 400
 
     # 如果沒有會話，自動啟動
+    ai_controller = AI_SESSIONS.get(sid)
     if not ai_controller:
         try:
-            ai_controller = create_ai_controller(use_claude=False, headless=False)
+            ai_controller = create_ai_controller(
+                use_claude=False, headless=False, browser=_acquire_browser(False)
+            )
             ai_controller.start_session()
+            AI_SESSIONS[sid] = ai_controller
         except Exception as e:
             return jsonify({
                 "success": False,
@@ -238,12 +556,10 @@ def execute_ai_prompt():
         except (TypeError, ValueError, KeyError) as e:
             app.logger.exception("Failed to create InvoiceData from input: %r", data.get("invoice_data"))
             invoice_data = None
-    elif current_invoice_data:
-        invoice_data = current_invoice_data
 
     try:
         result = ai_controller.process_prompt(prompt, invoice_data)
-        return jsonify(result)
+        return jsonify(serialize_result(result))
     except Exception as e:
         return jsonify({
             "success": False,
@@ -254,16 +570,16 @@ def execute_ai_prompt():
 @app.route("/api/ai/status", methods=["GET"])
 def get_ai_status():
     """取得 AI 會話狀態"""
-    global ai_controller
+    ai_controller = AI_SESSIONS.get(_session_id())
 
     if ai_controller and ai_controller.session:
-        session = ai_controller.session
+        ai_session = ai_controller.session
         return jsonify({
             "active": True,
-            "session_id": session.session_id,
-            "status": session.status,
-            "current_step": session.current_step,
-            "total_steps": session.total_steps
+            "session_id": ai_session.session_id,
+            "status": ai_session.status,
+            "current_step": ai_session.current_step,
+            "total_steps": ai_session.total_steps
         })
     else:
         return jsonify({
@@ -273,24 +589,33 @@ def get_ai_status():
 
 @app.route("/api/ai/screenshot", methods=["POST"])
 def take_screenshot():
-    """擷取當前瀏覽器截圖"""
-    global ai_controller
+    """
+    擷取當前瀏覽器截圖
+
+    Query Parameters:
+        format: image - 直接返回 JPEG 影像（不經 base64 與 JSON，回應較小）；
+            省略時返回含 base64 PNG 的 JSON
+    """
+    ai_controller = AI_SESSIONS.get(_session_id())
 
-    if not ai_controller or not ai_controller.browser.driver:
+    if not ai_controller or not ai_controller.browser.is_running:
         return jsonify({
             "success": False,
             "error": "沒有進行中的瀏覽器會話"
         }), 400
 
     try:
+        if request.args.get("format") == "image":
+            return Response(ai_controller.browser.screenshot_bytes(fmt="jpeg"), mimetype="image/jpeg")
+
         # 取得截圖
-        screenshot = ai_controller.browser.driver.get_screenshot_as_base64()
+        screenshot = base64.b64encode(ai_controller.browser.screenshot_bytes(fmt="png")).decode("ascii")
 
-        return jsonify({
+        return Response(dumps({
             "success": True,
             "screenshot": screenshot,
             "timestamp": datetime.datetime.now().isoformat()
-        })
+        }), mimetype="application/json")
     except Exception as e:
         return jsonify({
             "success": False,
@@ -300,65 +625,25 @@ def take_screenshot():
 
 @app.route("/api/ai/commands", methods=["GET"])
 def get_available_commands():
-    """取得可用的指令列表"""
-    commands = [
-        {
-            "command": "開啟電子發票平台",
-            "description": "前往財政部電子發票整合服務平台",
-            "example": "開啟電子發票平台"
-        },
-        {
-            "command": "前往 [網址]",
-            "description": "導航到指定網址",
-            "example": "前往 https://www.einvoice.nat.gov.tw/"
-        },
-        {
-            "command": "點擊 [元素]",
-            "description": "點擊頁面上的按鈕或連結",
-            "example": "點擊 登入按鈕"
-        },
-        {
-            "command": "輸入 [文字] 到 [欄位]",
-            "description": "在輸入框中填入文字",
-            "example": "輸入 12345678 到 統一編號"
-        },
-        {
-            "command": "填寫發票資料",
-            "description": "使用解析的發票資料自動填表",
-            "example": "填寫發票資料"
-        },
-        {
-            "command": "等待 [秒數] 秒",
-            "description": "等待指定時間",
-            "example": "等待 3 秒"
-        },
-        {
-            "command": "截圖",
-            "description": "擷取當前頁面截圖",
-            "example": "截圖"
-        },
-        {
-            "command": "登入",
-            "description": "執行登入操作（需要帳號密碼）",
-            "example": "登入"
-        },
-        {
-            "command": "提交",
-            "description": "提交當前表單",
-            "example": "提交"
-        },
-        {
-            "command": "滾動 [方向]",
-            "description": "滾動頁面（上/下/到底）",
-            "example": "滾動到底"
-        }
-    ]
-
-    return jsonify({
-        "success": True,
-        "commands": commands
-    })
+    """取得可用的指令列表（內容固定，返回預先序列化的 JSON 並允許客戶端快取）"""
+    response = Response(_COMMANDS_JSON, mimetype="application/json")
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
+
+
+def run_dev_server():
+    """
+    以 Flask 開發伺服器啟動（多執行緒，只接受本機連線）
+
+    除錯模式需設定 FLASK_DEBUG=1；正式環境請使用 gunicorn（見 gunicorn_conf.py）。
+    """
+    app.run(
+        host="127.0.0.1",
+        port=5000,
+        threaded=True,
+        debug=os.environ.get("FLASK_DEBUG") == "1",
+    )
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    run_dev_server()